@@ -3,16 +3,13 @@
 """The ipcluster application."""
 from __future__ import print_function
 
-import errno
 import logging
 import os
-import re
+import select
 import signal
-from subprocess import CalledProcessError
-from subprocess import check_call
-from subprocess import PIPE
+import time
+from functools import lru_cache
 
-import zmq
 from IPython.core.application import BaseIPythonApplication
 from IPython.core.profiledir import ProfileDir
 from IPython.utils.sysinfo import num_cpus
@@ -30,6 +27,7 @@ from traitlets import Unicode
 from traitlets.config.application import catch_config_error
 
 from .._version import __version__
+from ..util import ioloop
 from .baseapp import base_aliases
 from .baseapp import base_flags
 from .baseapp import BaseParallelApplication
@@ -94,12 +92,17 @@ ALREADY_STOPPED = 11
 # file to be found.
 NO_CLUSTER = 12
 
+# controller and engine log files removed by --clean-logs
+_log_prefixes = ('ipengine-', 'ipcontroller-')
+_log_suffixes = ('.log', '.err', '.out')
+
 
 # -----------------------------------------------------------------------------
 # Utilities
 # -----------------------------------------------------------------------------
 
 
+@lru_cache()
 def find_launcher_class(clsname, kind):
     """Return a launcher for a given clsname and kind.
 
@@ -111,6 +114,8 @@ def find_launcher_class(clsname, kind):
         Slurm, WindowsHPC).
     kind : str
         Either 'EngineSet' or 'Controller'.
+
+    Results are cached, since launchers are looked up repeatedly by name.
     """
     if '.' not in clsname:
         # not a module, presume it's the raw name in apps.launcher
@@ -123,6 +128,46 @@ def find_launcher_class(clsname, kind):
     return klass
 
 
+@lru_cache()
+def _launcher_classes(kind=None):
+    """Return the bundled launcher classes, optionally only those of a given kind
+
+    kind : str
+        e.g. 'EngineSet' or 'Controller'. If unspecified, all launchers are returned.
+    """
+    from ipyparallel.apps import launcher
+
+    return tuple(
+        cls for cls in launcher.all_launchers if kind is None or kind in cls.__name__
+    )
+
+
+def _pidfd_open(pid):
+    """Open a pidfd referring to `pid`
+
+    Returns None if pidfds are unavailable
+    (requires Python >= 3.9 and Linux >= 5.3).
+    """
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:
+        # ENOSYS on old kernels, ESRCH if the process is already gone
+        return None
+
+
+def _wait_pidfd(pidfd, timeout):
+    """Wait for the process referred to by `pidfd` to exit
+
+    Returns True if the process exited within `timeout` seconds.
+    """
+    poller = select.poll()
+    poller.register(pidfd, select.POLLIN)
+    return bool(poller.poll(int(timeout * 1000)))
+
+
 # -----------------------------------------------------------------------------
 # Main application
 # -----------------------------------------------------------------------------
@@ -174,6 +219,16 @@ class IPClusterStop(BaseParallelApplication):
         signal.SIGINT, config=True, help="signal to use for stopping processes."
     )
 
+    timeout = CFloat(
+        10,
+        config=True,
+        help="""Time (in seconds) to wait for the cluster to exit after signaling it.
+
+        Only used where the process can be waited on without polling
+        (Linux pidfd, Windows process handles).
+        """,
+    )
+
     aliases = Dict(stop_aliases)
 
     def start(self):
@@ -199,6 +254,9 @@ class IPClusterStop(BaseParallelApplication):
         elif os.name == 'posix':
             sig = self.signal
             self.log.info("Stopping cluster [pid=%r] with [signal=%r]" % (pid, sig))
+            # open the pidfd *before* signaling,
+            # so that we can't end up waiting on a recycled pid
+            pidfd = _pidfd_open(pid)
             try:
                 os.kill(pid, sig)
             except OSError:
@@ -206,13 +264,26 @@ class IPClusterStop(BaseParallelApplication):
                     "Stopping cluster failed, assuming already dead.", exc_info=True
                 )
                 self.remove_pid_file()
+            else:
+                if pidfd is not None:
+                    if _wait_pidfd(pidfd, self.timeout):
+                        self.log.info("Cluster [pid=%r] stopped" % pid)
+                    else:
+                        self.log.warning(
+                            "Cluster [pid=%r] still running after %is",
+                            pid,
+                            self.timeout,
+                        )
+            finally:
+                if pidfd is not None:
+                    os.close(pidfd)
         elif os.name == 'nt':
+            from .win32support import kill_tree
+
             try:
                 # kill the whole tree
-                check_call(
-                    ['taskkill', '-pid', str(pid), '-t', '-f'], stdout=PIPE, stderr=PIPE
-                )
-            except (CalledProcessError, OSError):
+                kill_tree(pid, self.timeout)
+            except OSError:
                 self.log.error(
                     "Stopping cluster failed, assuming already dead.", exc_info=True
                 )
@@ -251,11 +322,7 @@ class IPClusterEngines(BaseParallelApplication):
     classes = List()
 
     def _classes_default(self):
-        from ipyparallel.apps import launcher
-
-        launchers = launcher.all_launchers
-        eslaunchers = [l for l in launchers if 'EngineSet' in l.__name__]
-        return [ProfileDir] + eslaunchers
+        return [ProfileDir] + list(_launcher_classes('EngineSet'))
 
     n = Integer(
         num_cpus(),
@@ -344,7 +411,15 @@ class IPClusterEngines(BaseParallelApplication):
 
     def init_signal(self):
         # Setup signals
-        signal.signal(signal.SIGINT, self.sigint_handler)
+        asyncio_loop = getattr(self.loop, 'asyncio_loop', None)
+        if asyncio_loop is not None and os.name == 'posix':
+            # deliver SIGINT via the event loop's wakeup fd,
+            # rather than interrupting whatever happens to be running
+            asyncio_loop.add_signal_handler(
+                signal.SIGINT, self.sigint_handler, signal.SIGINT, None
+            )
+        else:
+            signal.signal(signal.SIGINT, self.sigint_handler)
 
     def build_launcher(self, clsname, kind=None):
         """import and instantiate a Launcher based on importstring"""
@@ -420,8 +495,42 @@ class IPClusterEngines(BaseParallelApplication):
             self._stopping = True
             self.log.error("IPython cluster: stopping")
             self.stop_engines()
-            # Wait a few seconds to let things shut down.
-            self.loop.add_timeout(self.loop.time() + 3, self.loop.stop)
+            # Wait (up to a few seconds) to let things shut down.
+            self.stop_loop_when_launchers_stopped()
+
+    def _launchers(self):
+        """The launchers this app waits for on shutdown"""
+        return [self.engine_launcher]
+
+    def stop_loop_when_launchers_stopped(self, timeout=3):
+        """Stop the event loop once all running launchers have stopped
+
+        Waits at most `timeout` seconds.
+        """
+        pending = [
+            launcher
+            for launcher in self._launchers()
+            if launcher is not None and launcher.running
+        ]
+        if not pending:
+            self.loop.add_callback(self.loop.stop)
+            return
+
+        timeout_handle = self.loop.add_timeout(
+            self.loop.time() + timeout, self.loop.stop
+        )
+        remaining = len(pending)
+
+        def launcher_stopped(data):
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                self.log.debug("All launchers stopped")
+                self.loop.remove_timeout(timeout_handle)
+                self.loop.stop()
+
+        for launcher in pending:
+            launcher.on_stop(launcher_stopped)
 
     def sigint_handler(self, signum, frame):
         self.log.debug("SIGINT received, stopping launchers...")
@@ -430,10 +539,11 @@ class IPClusterEngines(BaseParallelApplication):
     def start_logging(self):
         # Remove old log files of the controller and engine
         if self.clean_logs:
-            log_dir = self.profile_dir.log_dir
-            for f in os.listdir(log_dir):
-                if re.match(r'ip(engine|controller)-.+\.(log|err|out)', f):
-                    os.remove(os.path.join(log_dir, f))
+            with os.scandir(self.profile_dir.log_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.startswith(_log_prefixes) and name.endswith(_log_suffixes):
+                        os.remove(entry.path)
 
     def start(self):
         """Start the app for the engines subcommand."""
@@ -454,11 +564,6 @@ class IPClusterEngines(BaseParallelApplication):
             self.loop.start()
         except KeyboardInterrupt:
             pass
-        except zmq.ZMQError as e:
-            if e.errno == errno.EINTR:
-                pass
-            else:
-                raise
 
 
 start_aliases = {}
@@ -485,12 +590,8 @@ class IPClusterStart(IPClusterEngines):
     )
     classes = List()
 
-    def _classes_default(
-        self,
-    ):
-        from ipyparallel.apps import launcher
-
-        return [ProfileDir] + [IPClusterEngines] + launcher.all_launchers
+    def _classes_default(self):
+        return [ProfileDir] + [IPClusterEngines] + list(_launcher_classes())
 
     clean_logs = Bool(
         True, config=True, help="whether to cleanup old logs before starting"
@@ -499,7 +600,11 @@ class IPClusterStart(IPClusterEngines):
     delay = CFloat(
         1.0,
         config=True,
-        help="delay (in s) between starting the controller and the engines",
+        help="""maximum delay (in s) between starting the controller and the engines.
+
+        Engines are started as soon as the controller has written
+        its engine connection file, or after this delay, whichever comes first.
+        """,
     )
 
     controller_ip = Unicode(config=True, help="Set the IP address of the controller.")
@@ -609,6 +714,40 @@ class IPClusterStart(IPClusterEngines):
             self.log.exception("Controller start failed")
             raise
 
+    def _engine_connection_file(self):
+        """The path of the engine connection file written by the controller"""
+        if self.cluster_id:
+            fname = 'ipcontroller-%s-engine.json' % self.cluster_id
+        else:
+            fname = 'ipcontroller-engine.json'
+        return os.path.join(self.profile_dir.security_dir, fname)
+
+    def wait_for_controller(self, started, callback):
+        """Call `callback` once the controller is ready for engines
+
+        The controller is ready once it has written its engine connection file
+        (at or after `started`).
+        Gives up waiting after `self.delay` seconds and calls `callback` anyway,
+        since the connection file may not be visible to us
+        (e.g. controller launched on a remote host).
+        """
+        url_file = self._engine_connection_file()
+        deadline = self.loop.time() + self.delay
+        # mtime may have 1s resolution
+        started = int(started)
+
+        def check():
+            try:
+                ready = os.stat(url_file).st_mtime >= started
+            except OSError:
+                ready = False
+            if ready or self.loop.time() >= deadline:
+                pc.stop()
+                callback()
+
+        pc = ioloop.PeriodicCallback(check, 50)
+        pc.start()
+
     def stop_controller(self):
         # self.log.info("In stop_controller")
         if self.controller_launcher and self.controller_launcher.running:
@@ -619,6 +758,9 @@ class IPClusterStart(IPClusterEngines):
             self.stop_controller()
             super(IPClusterStart, self).stop_launchers()
 
+    def _launchers(self):
+        return [self.controller_launcher, self.engine_launcher]
+
     def start(self):
         """Start the app for the start subcommand."""
         # First see if the cluster is already running
@@ -646,8 +788,9 @@ class IPClusterStart(IPClusterEngines):
                 daemonize()
 
         def start():
+            started = time.time()
             self.start_controller()
-            self.loop.add_timeout(self.loop.time() + self.delay, self.start_engines)
+            self.wait_for_controller(started, self.start_engines)
 
         self.loop.add_callback(start)
         # Now write the new pid file AFTER our new forked pid is active.
@@ -656,11 +799,6 @@ class IPClusterStart(IPClusterEngines):
             self.loop.start()
         except KeyboardInterrupt:
             pass
-        except zmq.ZMQError as e:
-            if e.errno == errno.EINTR:
-                pass
-            else:
-                raise
         finally:
             self.remove_pid_file()
 
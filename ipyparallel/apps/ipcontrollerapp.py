@@ -5,14 +5,22 @@ The IPython controller application.
 """
 # Copyright (c) IPython Development Team.
 # Distributed under the terms of the Modified BSD License.
-from __future__ import with_statement
-
-import json
+import logging
 import os
 import socket
-import stat
 import sys
-from multiprocessing import Process
+import tempfile
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from multiprocessing import get_context
+from multiprocessing import get_start_method
+from multiprocessing.process import BaseProcess
+from operator import itemgetter
+from queue import Queue
 from signal import SIGABRT
 from signal import SIGINT
 from signal import signal
@@ -26,6 +34,8 @@ from jupyter_client.session import session_aliases
 from jupyter_client.session import session_flags
 from traitlets import Bool
 from traitlets import Dict
+from traitlets import Instance
+from traitlets import Integer
 from traitlets import List
 from traitlets import observe
 from traitlets import TraitError
@@ -45,29 +55,102 @@ from ipyparallel.controller.hub import HubFactory
 from ipyparallel.controller.scheduler import launch_scheduler
 from ipyparallel.controller.task_scheduler import TaskScheduler
 from ipyparallel.util import disambiguate_url
+from ipyparallel.util import json_dumps
+from ipyparallel.util import json_load_file
+
+# optional db backends, only imported when needed for help or config output
+_real_db_names = (
+    'ipyparallel.controller.sqlitedb.SQLiteDB',
+    'ipyparallel.controller.mongodb.MongoDB',
+)
+
+
+@lru_cache()
+def _real_db_classes():
+    """Return the SQLiteDB / MongoDB backend classes that can be imported
 
-# conditional import of SQLiteDB / MongoDB backend class
-real_dbs = []
+    These pull in sqlite3 and pymongo, which the default in-memory backends
+    don't need, so they are not imported at startup.
+    """
+    classes = []
+    for name in _real_db_names:
+        try:
+            classes.append(import_item(name))
+        except ImportError:
+            pass
+    return tuple(classes)
 
-try:
-    from ipyparallel.controller.sqlitedb import SQLiteDB
-except ImportError:
-    pass
-else:
-    real_dbs.append(SQLiteDB)
 
-try:
-    from ipyparallel.controller.mongodb import MongoDB
-except ImportError:
-    pass
-else:
-    real_dbs.append(MongoDB)
+@lru_cache()
+def _import_mq_class(name):
+    """Import a MonitoredQueue class by name, once per name"""
+    return import_item(name)
 
 
 # -----------------------------------------------------------------------------
 # Module level variables
 # -----------------------------------------------------------------------------
 
+# spec for constructing a relay device, see IPControllerApp._make_relay
+_relay_spec = namedtuple(
+    '_relay_spec',
+    [
+        'channel',
+        'in_type',
+        'out_type',
+        'in_prefix',
+        'out_prefix',
+        'in_opts',
+        'out_opts',
+    ],
+)
+
+_mux_control_relays = (
+    _relay_spec(
+        'mux',
+        zmq.ROUTER,
+        zmq.ROUTER,
+        b'in',
+        b'out',
+        in_opts=[(zmq.IDENTITY, b'mux_in')],
+        out_opts=[(zmq.IDENTITY, b'mux_out')],
+    ),
+    _relay_spec(
+        'control',
+        zmq.ROUTER,
+        zmq.ROUTER,
+        b'incontrol',
+        b'outcontrol',
+        in_opts=[(zmq.IDENTITY, b'control_in')],
+        out_opts=[(zmq.IDENTITY, b'control_out')],
+    ),
+)
+
+_pure_task_relay = _relay_spec(
+    'task',
+    zmq.ROUTER,
+    zmq.DEALER,
+    b'intask',
+    b'outtask',
+    in_opts=[(zmq.IDENTITY, b'task_in')],
+    out_opts=[(zmq.IDENTITY, b'task_out')],
+)
+
+# (setter name, option) pairs for unlimited HWM on relay devices
+_unlimited_hwm_opts = (
+    ('setsockopt_in', zmq.SNDHWM),
+    ('setsockopt_in', zmq.RCVHWM),
+    ('setsockopt_out', zmq.SNDHWM),
+    ('setsockopt_out', zmq.RCVHWM),
+    ('setsockopt_mon', zmq.SNDHWM),
+)
+
+
+def _set_unlimited_hwm(q):
+    """Set unlimited HWM on all the sockets of a relay device"""
+    for setter, opt in _unlimited_hwm_opts:
+        getattr(q, setter)(opt, 0)
+
 
 _description = """Start the IPython controller for parallel computing.
 
@@ -150,17 +233,28 @@ aliases.update(session_aliases)
 
 class IPControllerApp(BaseParallelApplication):
 
-    name = u'ipcontroller'
+    name = 'ipcontroller'
     description = _description
     examples = _examples
-    classes = [
-        ProfileDir,
-        Session,
-        HubFactory,
-        TaskScheduler,
-        HeartMonitor,
-        DictDB,
-    ] + real_dbs
+    classes = List()
+
+    def _classes_default(self):
+        return [ProfileDir, Session, HubFactory, TaskScheduler, HeartMonitor, DictDB]
+
+    def _add_real_db_classes(self):
+        """Add the optional db backends to classes, for help and config output"""
+        for cls in _real_db_classes():
+            if cls not in self.classes:
+                self.classes.append(cls)
+
+    def print_help(self, classes=False):
+        if classes:
+            self._add_real_db_classes()
+        super().print_help(classes)
+
+    def generate_config_file(self, *args, **kwargs):
+        self._add_real_db_classes()
+        return super().generate_config_file(*args, **kwargs)
 
     # change default to True
     auto_create = Bool(
@@ -181,14 +275,14 @@ class IPControllerApp(BaseParallelApplication):
         """,
     )
     ssh_server = Unicode(
-        u'',
+        '',
         config=True,
         help="""ssh url for clients to use when connecting to the Controller
         processes. It should be of the form: [user@]server[:port]. The
         Controller's listening addresses must be accessible from the ssh server""",
     )
     engine_ssh_server = Unicode(
-        u'',
+        '',
         config=True,
         help="""ssh url for engines to use when connecting to the Controller
         processes. It should be of the form: [user@]server[:port]. The
@@ -210,6 +304,34 @@ class IPControllerApp(BaseParallelApplication):
         False, config=True, help='Use threads instead of processes for the schedulers'
     )
 
+    io_threads = Integer(
+        1,
+        config=True,
+        help="""The number of zmq IO threads in the controller's zmq Context.
+
+        The Hub, in-thread schedulers (use_threads) and log forwarding
+        share this Context.
+        Relays and schedulers running in subprocesses have their own.
+        """,
+    )
+
+    context = Instance(zmq.Context)
+
+    def _context_default(self):
+        return zmq.Context.instance(io_threads=self.io_threads)
+
+    mp_start_method = Unicode(
+        '',
+        config=True,
+        help="""The multiprocessing start method for Python scheduler processes
+        ('fork', 'spawn', or 'forkserver').
+
+        Default: the multiprocessing default for the platform.
+        With 'forkserver', the scheduler modules are preloaded in the fork server,
+        so each scheduler is forked from a small, pre-warmed process.
+        """,
+    )
+
     engine_json_file = Unicode(
         'ipcontroller-engine.json',
         config=True,
@@ -224,8 +346,8 @@ class IPControllerApp(BaseParallelApplication):
     @observe('cluster_id')
     def _cluster_id_changed(self, change):
         super(IPControllerApp, self)._cluster_id_changed(change)
-        self.engine_json_file = "%s-engine.json" % self.name
-        self.client_json_file = "%s-client.json" % self.name
+        self.engine_json_file = f"{self.name}-engine.json"
+        self.client_json_file = f"{self.name}-client.json"
 
     # internal
     children = List()
@@ -248,24 +370,41 @@ class IPControllerApp(BaseParallelApplication):
     flags = Dict(flags)
 
     def save_connection_dict(self, fname, cdict):
-        """save a connection dict to json file."""
+        """save a connection dict to json file.
+
+        fname may be relative to the security dir, or an absolute path.
+        """
         fname = os.path.join(self.profile_dir.security_dir, fname)
         self.log.info("writing connection info to %s", fname)
-        with open(fname, 'w') as f:
-            f.write(json.dumps(cdict, indent=2))
-        os.chmod(fname, stat.S_IRUSR | stat.S_IWUSR)
+        # connection files are read by other processes,
+        # only pretty-print them when debugging
+        indent = 2 if self.log_level <= logging.DEBUG else None
+        # write to a private (0600) temporary file and rename it into place,
+        # so engines never see a partially written file
+        fd, tmp_fname = tempfile.mkstemp(
+            dir=os.path.dirname(fname),
+            prefix='.' + os.path.basename(fname),
+            suffix='.tmp',
+        )
+        try:
+            with open(fd, 'wb') as f:
+                f.write(json_dumps(cdict, indent=indent))
+            os.replace(tmp_fname, fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
 
     def load_config_from_json(self):
         """load config from existing json connector files."""
         c = self.config
+        security_dir = self.profile_dir.security_dir
         self.log.debug("loading config from JSON")
 
         # load engine config
 
-        fname = os.path.join(self.profile_dir.security_dir, self.engine_json_file)
+        fname = os.path.join(security_dir, self.engine_json_file)
         self.log.info("loading connection info from %s", fname)
-        with open(fname) as f:
-            ecfg = json.loads(f.read())
+        ecfg = json_load_file(fname)
 
         # json gives unicode, Session.key wants bytes
         c.Session.key = ecfg['key'].encode('ascii')
@@ -281,14 +420,16 @@ class IPControllerApp(BaseParallelApplication):
 
         # load client config
 
-        fname = os.path.join(self.profile_dir.security_dir, self.client_json_file)
+        fname = os.path.join(security_dir, self.client_json_file)
         self.log.info("loading connection info from %s", fname)
-        with open(fname) as f:
-            ccfg = json.loads(f.read())
-
-        for key in ('key', 'registration', 'pack', 'unpack', 'signature_scheme'):
-            assert ccfg[key] == ecfg[key], (
-                "mismatch between engine and client info: %r" % key
+        ccfg = json_load_file(fname)
+
+        shared_keys = ('key', 'registration', 'pack', 'unpack', 'signature_scheme')
+        get_shared = itemgetter(*shared_keys)
+        if get_shared(ccfg) != get_shared(ecfg):
+            mismatched = [key for key in shared_keys if ccfg[key] != ecfg[key]]
+            raise AssertionError(
+                "mismatch between engine and client info: %r" % mismatched
             )
 
         xport, ip = ccfg['interface'].split('://')
@@ -312,14 +453,17 @@ class IPControllerApp(BaseParallelApplication):
             self.log.debug("leaving JSON connection files for reuse")
             return
         self.log.debug("cleaning up JSON connection files")
+        security_dir = self.profile_dir.security_dir
         for f in (self.client_json_file, self.engine_json_file):
-            f = os.path.join(self.profile_dir.security_dir, f)
+            f = os.path.join(security_dir, f)
             try:
                 os.remove(f)
-            except Exception as e:
+            except FileNotFoundError:
+                self.log.debug("connection file already removed: %s", f)
+            except OSError as e:
                 self.log.error("Failed to cleanup connection file: %s", e)
             else:
-                self.log.debug(u"removed %s", f)
+                self.log.debug("removed %s", f)
 
     def load_secondary_config(self):
         """secondary config, loading from JSON and setting defaults"""
@@ -345,6 +489,7 @@ class IPControllerApp(BaseParallelApplication):
             self.factory = HubFactory(
                 config=c,
                 log=self.log,
+                context=self.context,
             )
             # self.start_logging()
             self.factory.init_hub()
@@ -356,6 +501,7 @@ class IPControllerApp(BaseParallelApplication):
 
         if self.write_connection_files:
             # save to new json config files
+            security_dir = self.profile_dir.security_dir
             f = self.factory
             base = {
                 'key': f.session.key.decode('ascii'),
@@ -368,12 +514,16 @@ class IPControllerApp(BaseParallelApplication):
             cdict = {'ssh': self.ssh_server}
             cdict.update(f.client_info)
             cdict.update(base)
-            self.save_connection_dict(self.client_json_file, cdict)
+            self.save_connection_dict(
+                os.path.join(security_dir, self.client_json_file), cdict
+            )
 
             edict = {'ssh': self.engine_ssh_server}
             edict.update(f.engine_info)
             edict.update(base)
-            self.save_connection_dict(self.engine_json_file, edict)
+            self.save_connection_dict(
+                os.path.join(security_dir, self.engine_json_file), edict
+            )
 
         fname = "engines%s.json" % self.cluster_id
         self.factory.hub.engine_state_file = os.path.join(
@@ -385,10 +535,43 @@ class IPControllerApp(BaseParallelApplication):
         # have the same value
         self.config.Session.key = self.factory.session.key
 
+    _mp_context = None
+
+    @property
+    def mp_context(self):
+        """The multiprocessing context used for Python scheduler processes"""
+        if self._mp_context is None:
+            ctx = get_context(self.mp_start_method or None)
+            if ctx.get_start_method() == 'forkserver':
+                ctx.set_forkserver_preload(
+                    [
+                        'zmq',
+                        'ipyparallel.controller.scheduler',
+                        'ipyparallel.controller.task_scheduler',
+                        'ipyparallel.controller.broadcast_scheduler',
+                    ]
+                )
+            self._mp_context = ctx
+        return self._mp_context
+
+    def _make_relay(self, mq, spec, monitor_url):
+        """Construct a relay device (MonitoredQueue) from a _relay_spec"""
+        f = self.factory
+        q = mq(spec.in_type, spec.out_type, zmq.PUB, spec.in_prefix, spec.out_prefix)
+        q.bind_in(f.client_url(spec.channel))
+        for opt, value in spec.in_opts:
+            q.setsockopt_in(opt, value)
+        q.bind_out(f.engine_url(spec.channel))
+        for opt, value in spec.out_opts:
+            q.setsockopt_out(opt, value)
+        q.connect_mon(monitor_url)
+        q.daemon = True
+        return q
+
     def launch_python_scheduler(self, scheduler_args, children):
         if 'Process' in self.mq_class:
             # run the Python scheduler in a Process
-            q = Process(target=launch_scheduler, kwargs=scheduler_args)
+            q = self.mp_context.Process(target=launch_scheduler, kwargs=scheduler_args)
             q.daemon = True
             children.append(q)
         else:
@@ -398,43 +581,30 @@ class IPControllerApp(BaseParallelApplication):
 
     def init_schedulers(self):
         children = self.children
-        mq = import_item(str(self.mq_class))
+        mq = _import_mq_class(str(self.mq_class))
+        # snapshot of config passed to each Python scheduler
+        config = dict(self.config)
 
         f = self.factory
         ident = f.session.bsession
         # disambiguate url, in case of *
         monitor_url = disambiguate_url(f.monitor_url)
         # maybe_inproc = 'inproc://monitor' if self.use_threads else monitor_url
-        # IOPub relay (in a Process)
-        q = mq(zmq.PUB, zmq.SUB, zmq.PUB, b'N/A', b'iopub')
-        q.bind_in(f.client_url('iopub'))
-        q.setsockopt_in(zmq.IDENTITY, ident + b"_iopub")
-        q.bind_out(f.engine_url('iopub'))
-        q.setsockopt_out(zmq.SUBSCRIBE, b'')
-        q.connect_mon(monitor_url)
-        q.daemon = True
-        children.append(q)
+        relays = [
+            # IOPub relay (in a Process)
+            _relay_spec(
+                'iopub',
+                zmq.PUB,
+                zmq.SUB,
+                b'N/A',
+                b'iopub',
+                in_opts=[(zmq.IDENTITY, ident + b"_iopub")],
+                out_opts=[(zmq.SUBSCRIBE, b'')],
+            ),
+        ]
+        # Multiplexer and Control Queues (in a Process)
+        relays.extend(_mux_control_relays)
 
-        # Multiplexer Queue (in a Process)
-        q = mq(zmq.ROUTER, zmq.ROUTER, zmq.PUB, b'in', b'out')
-
-        q.bind_in(f.client_url('mux'))
-        q.setsockopt_in(zmq.IDENTITY, b'mux_in')
-        q.bind_out(f.engine_url('mux'))
-        q.setsockopt_out(zmq.IDENTITY, b'mux_out')
-        q.connect_mon(monitor_url)
-        q.daemon = True
-        children.append(q)
-
-        # Control Queue (in a Process)
-        q = mq(zmq.ROUTER, zmq.ROUTER, zmq.PUB, b'incontrol', b'outcontrol')
-        q.bind_in(f.client_url('control'))
-        q.setsockopt_in(zmq.IDENTITY, b'control_in')
-        q.bind_out(f.engine_url('control'))
-        q.setsockopt_out(zmq.IDENTITY, b'control_out')
-        q.connect_mon(monitor_url)
-        q.daemon = True
-        children.append(q)
         if 'TaskScheduler.scheme_name' in self.config:
             scheme = self.config.TaskScheduler.scheme_name
         else:
@@ -442,86 +612,133 @@ class IPControllerApp(BaseParallelApplication):
         # Task Queue (in a Process)
         if scheme == 'pure':
             self.log.warn("task::using pure DEALER Task scheduler")
-            q = mq(zmq.ROUTER, zmq.DEALER, zmq.PUB, b'intask', b'outtask')
-            # q.setsockopt_out(zmq.HWM, hub.hwm)
-            q.bind_in(f.client_url('task'))
-            q.setsockopt_in(zmq.IDENTITY, b'task_in')
-            q.bind_out(f.engine_url('task'))
-            q.setsockopt_out(zmq.IDENTITY, b'task_out')
-            q.connect_mon(monitor_url)
-            q.daemon = True
-            children.append(q)
+            relays.append(_pure_task_relay)
         elif scheme == 'none':
             self.log.warn("task::using no Task scheduler")
 
-        else:
+        # the relay devices, whose sockets are tuned below
+        relay_devices = [self._make_relay(mq, spec, monitor_url) for spec in relays]
+        children.extend(relay_devices)
+
+        if scheme not in {'pure', 'none'}:
             self.log.info("task::using Python %s Task scheduler" % scheme)
             self.launch_python_scheduler(
-                self.get_python_scheduler_args('task', f, TaskScheduler, monitor_url),
+                self.get_python_scheduler_args(
+                    'task', f, TaskScheduler, monitor_url, config=config
+                ),
                 children,
             )
 
-        self.launch_broadcast_schedulers(f, monitor_url, children)
+        self.launch_broadcast_schedulers(f, monitor_url, children, config=config)
 
         # set unlimited HWM for all relay devices
         if hasattr(zmq, 'SNDHWM'):
-            q = children[0]
+            q = relay_devices[0]
             q.setsockopt_in(zmq.RCVHWM, 0)
             q.setsockopt_out(zmq.SNDHWM, 0)
 
-            for q in children[1:]:
-                if not hasattr(q, 'setsockopt_in'):
-                    continue
-                q.setsockopt_in(zmq.SNDHWM, 0)
-                q.setsockopt_in(zmq.RCVHWM, 0)
-                q.setsockopt_out(zmq.SNDHWM, 0)
-                q.setsockopt_out(zmq.RCVHWM, 0)
-                q.setsockopt_mon(zmq.SNDHWM, 0)
+            for q in relay_devices[1:]:
+                _set_unlimited_hwm(q)
 
     def terminate_children(self):
         child_procs = []
         for child in self.children:
             if isinstance(child, ProcessMonitoredQueue):
                 child_procs.append(child.launcher)
-            elif isinstance(child, Process):
+            elif isinstance(child, BaseProcess):
                 child_procs.append(child)
-        if child_procs:
+        # skip children never started, and those that have already exited:
+        # checking exitcode reaps them, and a reaped child's pid may be reused
+        live_procs = [
+            child for child in child_procs if child.pid and child.exitcode is None
+        ]
+        if live_procs:
             self.log.critical("terminating children...")
-            for child in child_procs:
+            for child in live_procs:
                 try:
                     child.terminate()
                 except OSError:
                     # already dead
                     pass
 
+    def start_children(self):
+        """Start the relay and scheduler children
+
+        Children started with 'spawn' or 'forkserver' block while the new process
+        is set up, so they are started concurrently.
+        Forked children (and threads) are started serially from this thread,
+        since forking while other threads are running is unsafe.
+        """
+        serial = []
+        concurrent = []
+        for child in self.children:
+            if isinstance(child, BaseProcess):
+                method = self.mp_context.get_start_method()
+            elif isinstance(child, ProcessMonitoredQueue):
+                method = get_start_method()
+            else:
+                method = None
+            if method in {'spawn', 'forkserver'}:
+                concurrent.append(child)
+            else:
+                serial.append(child)
+
+        for child in serial:
+            child.start()
+        if concurrent:
+            with ThreadPoolExecutor(max_workers=min(32, len(concurrent))) as pool:
+                # consume results to raise any errors
+                list(pool.map(lambda child: child.start(), concurrent))
+
     def handle_signal(self, sig, frame):
         self.log.critical("Received signal %i, shutting down", sig)
         self.terminate_children()
         self.loop.stop()
 
     def init_signal(self):
+        asyncio_loop = getattr(self.factory.loop, 'asyncio_loop', None)
         for sig in (SIGINT, SIGABRT, SIGTERM):
-            signal(sig, self.handle_signal)
+            if asyncio_loop is not None and os.name == 'posix':
+                # deliver signals via the event loop's wakeup fd,
+                # rather than interrupting whatever happens to be running
+                asyncio_loop.add_signal_handler(sig, self.handle_signal, sig, None)
+            else:
+                signal(sig, self.handle_signal)
 
     def do_import_statements(self):
         statements = self.import_statements
         for s in statements:
             try:
-                self.log.msg("Executing statement: '%s'" % s)
-                exec(s, globals(), locals())
-            except:
-                self.log.msg("Error running statement: %s" % s)
+                code = compile(s, '<import_statements>', 'exec')
+            except SyntaxError:
+                self.log.error("Invalid import statement: %s", s, exc_info=True)
+                continue
+            self.log.info("Executing statement: '%s'", s)
+            try:
+                exec(code, globals(), locals())
+            except Exception:
+                self.log.error("Error running statement: %s", s, exc_info=True)
+
+    _log_listener = None
 
     def forward_logging(self):
         if self.log_url:
             self.log.info("Forwarding logging to %s" % self.log_url)
-            context = zmq.Context.instance()
-            lsock = context.socket(zmq.PUB)
+            lsock = self.context.socket(zmq.PUB)
             lsock.connect(self.log_url)
             handler = PUBHandler(lsock)
             handler.root_topic = 'controller'
             handler.setLevel(self.log_level)
-            self.log.addHandler(handler)
+            # send from a background thread, which owns the socket,
+            # so that logging never waits on zmq in the controller's event loop
+            log_queue = Queue()
+            self._log_listener = QueueListener(
+                log_queue, handler, respect_handler_level=True
+            )
+            self._log_listener.start()
+            queue_handler = QueueHandler(log_queue)
+            queue_handler.setLevel(self.log_level)
+            self.log.addHandler(queue_handler)
 
     @catch_config_error
     def initialize(self, argv=None):
@@ -536,8 +753,7 @@ class IPControllerApp(BaseParallelApplication):
         self.factory.start()
         # children must be started before signals are setup,
         # otherwise signal-handling will fire multiple times
-        for child in self.children:
-            child.start()
+        self.start_children()
         self.init_signal()
 
         self.write_pid_file(overwrite=True)
@@ -548,10 +764,21 @@ class IPControllerApp(BaseParallelApplication):
             self.log.critical("Interrupted, Exiting...\n")
         finally:
             self.cleanup_connection_files()
+            if self._log_listener is not None:
+                # flush forwarded log messages
+                self._log_listener.stop()
 
     def get_python_scheduler_args(
-        self, scheduler_name, factory, scheduler_class, monitor_url, identity=None
+        self,
+        scheduler_name,
+        factory,
+        scheduler_class,
+        monitor_url,
+        identity=None,
+        config=None,
     ):
+        if config is None:
+            config = dict(self.config)
         return {
             'scheduler_class': scheduler_class,
             'in_addr': factory.client_url(scheduler_name),
@@ -563,15 +790,20 @@ class IPControllerApp(BaseParallelApplication):
             'logname': 'scheduler',
             'loglevel': self.log_level,
             'log_url': self.log_url,
-            'config': dict(self.config),
+            'config': config,
         }
 
-    def launch_broadcast_schedulers(self, factory, monitor_url, children):
+    def launch_broadcast_schedulers(self, factory, monitor_url, children, config=None):
+        if config is None:
+            config = dict(self.config)
+
         def launch_in_thread_or_process(scheduler_args):
 
             if 'Process' in self.mq_class:
                 # run the Python scheduler in a Process
-                q = Process(target=launch_broadcast_scheduler, kwargs=scheduler_args)
+                q = self.mp_context.Process(
+                    target=launch_broadcast_scheduler, kwargs=scheduler_args
+                )
                 q.daemon = True
                 children.append(q)
             else:
@@ -579,20 +811,30 @@ class IPControllerApp(BaseParallelApplication):
                 scheduler_args['in_thread'] = True
                 launch_broadcast_scheduler(**scheduler_args)
 
-        def recursively_start_schedulers(identity, depth):
+        max_depth = factory.broadcast_scheduler_depth
+        n_non_leaf = factory.number_of_non_leaf_schedulers
+        # args shared by all schedulers in the tree
+        base_args = dict(
+            mon_addr=monitor_url,
+            not_addr=disambiguate_url(factory.client_url('notification')),
+            reg_addr=disambiguate_url(factory.client_url('registration')),
+            config=config,
+            loglevel=self.log_level,
+            log_url=self.log_url,
+        )
+
+        # walk the binary tree of schedulers breadth-first
+        pending = deque([(0, 0)])
+        while pending:
+            identity, depth = pending.popleft()
             outgoing_id1 = identity * 2 + 1
             outgoing_id2 = outgoing_id1 + 1
-            is_leaf = depth == self.factory.broadcast_scheduler_depth
+            is_leaf = depth == max_depth
 
             scheduler_args = dict(
+                base_args,
                 in_addr=factory.client_url(BroadcastScheduler.port_name, identity),
-                mon_addr=monitor_url,
-                not_addr=disambiguate_url(factory.client_url('notification')),
-                reg_addr=disambiguate_url(factory.client_url('registration')),
                 identity=identity,
-                config=dict(self.config),
-                loglevel=self.log_level,
-                log_url=self.log_url,
                 outgoing_ids=[outgoing_id1, outgoing_id2],
                 depth=depth,
                 is_leaf=is_leaf,
@@ -602,7 +844,7 @@ class IPControllerApp(BaseParallelApplication):
                     out_addrs=[
                         factory.engine_url(
                             BroadcastScheduler.port_name,
-                            identity - factory.number_of_non_leaf_schedulers,
+                            identity - n_non_leaf,
                         )
                     ],
                 )
@@ -615,10 +857,8 @@ class IPControllerApp(BaseParallelApplication):
                 )
             launch_in_thread_or_process(scheduler_args)
             if not is_leaf:
-                recursively_start_schedulers(outgoing_id1, depth + 1)
-                recursively_start_schedulers(outgoing_id2, depth + 1)
-
-        recursively_start_schedulers(0, 0)
+                pending.append((outgoing_id1, depth + 1))
+                pending.append((outgoing_id2, depth + 1))
 
 
 def launch_new_instance(*args, **kwargs):
@@ -5,23 +5,23 @@ The IPython engine application
 """
 # Copyright (c) IPython Development Team.
 # Distributed under the terms of the Modified BSD License.
-import json
+import importlib.util
 import os
 import sys
+import threading
 import time
 
 import zmq
-from ipykernel.ipkernel import IPythonKernel as Kernel
-from ipykernel.kernelapp import IPKernelApp
-from ipykernel.zmqshell import ZMQInteractiveShell
 from IPython.core.profiledir import ProfileDir
-from ipython_genutils.py3compat import cast_bytes
 from jupyter_client.session import Session
 from jupyter_client.session import session_aliases
 from jupyter_client.session import session_flags
+from traitlets import Bool
+from traitlets import default
 from traitlets import Dict
 from traitlets import Float
 from traitlets import Instance
+from traitlets import Integer
 from traitlets import List
 from traitlets import observe
 from traitlets import Unicode
@@ -30,9 +30,9 @@ from ipyparallel.apps.baseapp import base_aliases
 from ipyparallel.apps.baseapp import base_flags
 from ipyparallel.apps.baseapp import BaseParallelApplication
 from ipyparallel.apps.baseapp import catch_config_error
-from ipyparallel.engine.engine import EngineFactory
 from ipyparallel.engine.log import EnginePUBHandler
 from ipyparallel.util import disambiguate_ip_address
+from ipyparallel.util import json_loads
 
 # -----------------------------------------------------------------------------
 # Module level variables
@@ -54,24 +54,127 @@ ipengine --log-to-file --log-level=DEBUG  # log to a file with DEBUG verbosity
 """
 
 
+def _wait_for_file(path, timeout):
+    """Wait up to `timeout` seconds for the file at `path` to exist
+
+    If watchdog is available, filesystem events (inotify, kqueue, etc.)
+    wake us as soon as the file is created.
+    Existence is still checked periodically, because events are not
+    delivered for changes made by other hosts on shared filesystems (NFS, GPFS).
+
+    Returns whether the file exists.
+    """
+    path = os.path.abspath(path)
+    if os.path.exists(path):
+        return True
+    deadline = time.monotonic() + timeout
+    arrived = threading.Event()
+    observer = None
+    interval = 0.1
+    try:
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+    except ImportError:
+        pass
+    else:
+        name = os.path.basename(path)
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                for p in (event.src_path, getattr(event, 'dest_path', '')):
+                    if os.path.basename(p) == name:
+                        arrived.set()
+
+        observer = Observer()
+        try:
+            observer.schedule(_Handler(), os.path.dirname(path))
+            observer.start()
+        except OSError:
+            observer = None
+        else:
+            # local changes are signaled, only poll for shared filesystems
+            interval = 0.5
+    try:
+        while not os.path.exists(path):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            arrived.wait(min(interval, remaining))
+            arrived.clear()
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+    return True
+
+
+# packages whose modules an engine loads at startup
+_prefetch_packages = (
+    'ipykernel',
+    'IPython',
+    'jupyter_client',
+    'zmq',
+    'tornado',
+    'ipyparallel',
+)
+
+
+def _prefetch_package_files(packages=_prefetch_packages):
+    """Ask the OS to read ahead the compiled modules of packages
+
+    Readahead requests are issued for every .pyc file at once,
+    so they are fetched in parallel into the page cache,
+    instead of one at a time as modules are imported.
+    On a cold node (e.g. with site-packages on a shared filesystem),
+    this warms the cache for this and any other engines starting on the node.
+    Requires posix_fadvise, otherwise this does nothing.
+    """
+    fadvise = getattr(os, 'posix_fadvise', None)
+    if fadvise is None:
+        return
+    for name in packages:
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            continue
+        if spec is None or not spec.submodule_search_locations:
+            continue
+        for pkg_dir in spec.submodule_search_locations:
+            for parent, dirs, files in os.walk(pkg_dir):
+                for fname in files:
+                    if not fname.endswith('.pyc'):
+                        continue
+                    try:
+                        fd = os.open(os.path.join(parent, fname), os.O_RDONLY)
+                    except OSError:
+                        continue
+                    try:
+                        fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                    except OSError:
+                        pass
+                    finally:
+                        os.close(fd)
+
+
 # -----------------------------------------------------------------------------
 # Main application
 # -----------------------------------------------------------------------------
-aliases = dict(
-    file='IPEngineApp.url_file',
-    c='IPEngineApp.startup_command',
-    s='IPEngineApp.startup_script',
-    url='EngineFactory.url',
-    ssh='EngineFactory.sshserver',
-    sshkey='EngineFactory.sshkey',
-    ip='EngineFactory.ip',
-    transport='EngineFactory.transport',
-    port='EngineFactory.regport',
-    location='EngineFactory.location',
-    timeout='EngineFactory.timeout',
-)
-aliases.update(base_aliases)
-aliases.update(session_aliases)
+aliases = {
+    'file': 'IPEngineApp.url_file',
+    'c': 'IPEngineApp.startup_command',
+    's': 'IPEngineApp.startup_script',
+    'url': 'EngineFactory.url',
+    'ssh': 'EngineFactory.sshserver',
+    'sshkey': 'EngineFactory.sshkey',
+    'ip': 'EngineFactory.ip',
+    'transport': 'EngineFactory.transport',
+    'port': 'EngineFactory.regport',
+    'location': 'EngineFactory.location',
+    'timeout': 'EngineFactory.timeout',
+    **base_aliases,
+    **session_aliases,
+}
+
 flags = {
     'mpi': (
         {
@@ -79,9 +182,9 @@ flags = {
         },
         "enable MPI integration",
     ),
+    **base_flags,
+    **session_flags,
 }
-flags.update(base_flags)
-flags.update(session_flags)
 
 
 class IPEngineApp(BaseParallelApplication):
@@ -89,7 +192,17 @@ class IPEngineApp(BaseParallelApplication):
     name = 'ipengine'
     description = _description
     examples = _examples
-    classes = List([ZMQInteractiveShell, ProfileDir, Session, EngineFactory, Kernel])
+    classes = List()
+
+    def _classes_default(self):
+        # ipykernel and the engine are imported on first use,
+        # so importing this module stays cheap (e.g. for ipyparallel.bind_kernel)
+        from ipykernel.ipkernel import IPythonKernel as Kernel
+        from ipykernel.zmqshell import ZMQInteractiveShell
+
+        from ipyparallel.engine.engine import EngineFactory
+
+        return [ZMQInteractiveShell, ProfileDir, Session, EngineFactory, Kernel]
 
     startup_script = Unicode(
         u'', config=True, help='specify a script to be run at startup'
@@ -99,13 +212,23 @@ class IPEngineApp(BaseParallelApplication):
     )
 
     url_file = Unicode(
-        u'',
         config=True,
         help="""The full location of the file containing the connection information for
         the controller. If this is not given, the file must be in the
         security directory of the cluster directory.  This location is
         resolved using the `profile` or `profile_dir` options.""",
     )
+
+    # the last default computed for url_file, so it can be recomputed
+    # if url_file_name changes after it was read
+    _computed_url_file = None
+
+    @default('url_file')
+    def _default_url_file(self):
+        url_file = os.path.join(self.profile_dir.security_dir, self.url_file_name)
+        self._computed_url_file = url_file
+        return url_file
+
     wait_for_url_file = Float(
         10,
         config=True,
@@ -125,6 +248,16 @@ class IPEngineApp(BaseParallelApplication):
             base = 'ipcontroller'
         self.url_file_name = "%s-engine.json" % base
 
+    @observe('url_file_name')
+    def _url_file_name_changed(self, change):
+        # only replace a url_file that came from the old default,
+        # not one that was set explicitly
+        if (
+            self._computed_url_file is not None
+            and self.url_file == self._computed_url_file
+        ):
+            self.url_file = self._default_url_file()
+
     log_url = Unicode(
         '',
         config=True,
@@ -132,8 +265,20 @@ class IPEngineApp(BaseParallelApplication):
         logging to a central location.""",
     )
 
+    io_threads = Integer(
+        1,
+        config=True,
+        help="""The number of zmq IO threads in the engine's zmq Context.""",
+    )
+
+    use_uvloop = Bool(
+        False,
+        config=True,
+        help="""Run the engine's event loop on uvloop, if it is installed.""",
+    )
+
     # an IPKernelApp instance, used to setup listening for shell frontends
-    kernel_app = Instance(IPKernelApp, allow_none=True)
+    kernel_app = Instance('ipykernel.kernelapp.IPKernelApp', allow_none=True)
 
     aliases = Dict(aliases)
     flags = Dict(flags)
@@ -149,32 +294,48 @@ class IPEngineApp(BaseParallelApplication):
         Here we don't try to actually see if it exists for is valid as that
         is hadled by the connection logic.
         """
-        # Find the actual controller key file
+        # url_file defaults to the controller's file in the security dir,
+        # but may also have been set to an empty string
         if not self.url_file:
-            self.url_file = os.path.join(
-                self.profile_dir.security_dir, self.url_file_name
-            )
+            self.url_file = self._default_url_file()
+
+    def _read_url_file(self):
+        """Read the contents of url_file
 
-    def load_connector_file(self):
+        Returns None if it doesn't exist.
+        """
+        try:
+            with open(self.url_file, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def load_connector_file(self, data=None):
         """load config from a JSON connector file,
         at a *lower* priority than command-line/config files.
+
+        data may be the already-read contents of url_file.
         """
 
         self.log.info("Loading url_file %r", self.url_file)
         config = self.config
 
-        with open(self.url_file) as f:
-            num_tries = 0
-            max_tries = 5
-            d = ""
-            while not d:
-                try:
-                    d = json.loads(f.read())
-                except ValueError:
-                    if num_tries > max_tries:
-                        raise
-                    num_tries += 1
-                    time.sleep(0.5)
+        # the file may still be being written, so retry with backoff,
+        # re-reading the whole file each time (up to ~2.5s total)
+        max_tries = 9
+        for attempt in range(max_tries):
+            if data is None:
+                with open(self.url_file, 'rb') as f:
+                    data = f.read()
+            try:
+                d = json_loads(data)
+            except ValueError:
+                if attempt + 1 == max_tries:
+                    raise
+                time.sleep(0.01 * 2 ** attempt)
+                data = None
+            else:
+                break
 
         # allow hand-override of location for disambiguation
         # and ssh-server
@@ -185,16 +346,18 @@ class IPEngineApp(BaseParallelApplication):
 
         location = config.EngineFactory.location
 
-        proto, ip = d['interface'].split('://')
-        ip = disambiguate_ip_address(ip, location)
-        d['interface'] = '%s://%s' % (proto, ip)
+        proto, _, ip = d['interface'].partition('://')
+        disambiguated_ip = disambiguate_ip_address(ip, location)
+        if disambiguated_ip != ip:
+            d['interface'] = f"{proto}://{disambiguated_ip}"
 
         # DO NOT allow override of basic URLs, serialization, or key
         # JSON file takes top priority there
-        config.Session.key = cast_bytes(d['key'])
+        key = d['key']
+        config.Session.key = key if isinstance(key, bytes) else key.encode('utf8')
         config.Session.signature_scheme = d['signature_scheme']
 
-        config.EngineFactory.url = d['interface'] + ':%i' % d['registration']
+        config.EngineFactory.url = f"{d['interface']}:{d['registration']}"
 
         config.Session.packer = d['pack']
         config.Session.unpacker = d['unpack']
@@ -208,6 +371,8 @@ class IPEngineApp(BaseParallelApplication):
         if self.kernel_app is not None:
             return
 
+        from ipykernel.kernelapp import IPKernelApp
+
         self.log.info("Opening ports for direct connections as an IPython kernel")
 
         kernel = self.kernel
@@ -225,7 +390,10 @@ class IPEngineApp(BaseParallelApplication):
         app.init_connection_file()
         # relevant contents of init_sockets:
 
-        app.shell_port = app._bind_socket(kernel.shell_streams[0], app.shell_port)
+        shell_stream = kernel.shell_streams[0]
+        # don't hang at shutdown on replies to frontends that have gone away
+        shell_stream.socket.setsockopt(zmq.LINGER, 1000)
+        app.shell_port = app._bind_socket(shell_stream, app.shell_port)
         app.log.debug("shell ROUTER Channel on port: %i", app.shell_port)
 
         iopub_socket = kernel.iopub_socket
@@ -233,9 +401,16 @@ class IPEngineApp(BaseParallelApplication):
         if hasattr(iopub_socket, 'socket'):
             iopub_socket = iopub_socket.socket
 
+        # queue bursts of output for frontends, rather than dropping them.
+        # Set before binding, since HWM applies to connections made afterward.
+        iopub_socket.setsockopt(zmq.SNDHWM, 100000)
+        iopub_socket.setsockopt(zmq.SNDBUF, 4 * 1024 * 1024)
         app.iopub_port = app._bind_socket(iopub_socket, app.iopub_port)
         app.log.debug("iopub PUB Channel on port: %i", app.iopub_port)
 
+        # the shell streams are already ZMQStreams dispatching via on_recv,
+        # but stdin must stay a plain socket: the kernel polls it directly
+        # while blocked waiting for an input_reply.
         kernel.stdin_socket = self.engine.context.socket(zmq.ROUTER)
         app.stdin_port = app._bind_socket(kernel.stdin_socket, app.stdin_port)
         app.log.debug("stdin ROUTER Channel on port: %i", app.stdin_port)
@@ -255,39 +430,35 @@ class IPEngineApp(BaseParallelApplication):
         # print config
         self.find_url_file()
 
-        # was the url manually specified?
-        keys = set(self.config.EngineFactory.keys())
-        keys = keys.union(set(self.config.RegistrationFactory.keys()))
-
-        if self.wait_for_url_file and not os.path.exists(self.url_file):
+        # read the file right away, rather than checking that it exists first
+        data = self._read_url_file()
+        if data is None and self.wait_for_url_file:
             self.log.warn("url_file %r not found", self.url_file)
             self.log.warn(
                 "Waiting up to %.1f seconds for it to arrive.", self.wait_for_url_file
             )
-            tic = time.time()
-            while not os.path.exists(self.url_file) and (
-                time.time() - tic < self.wait_for_url_file
-            ):
-                # wait for url_file to exist, or until time limit
-                time.sleep(0.1)
-
-        if os.path.exists(self.url_file):
-            self.load_connector_file()
-        else:
+            if _wait_for_file(self.url_file, self.wait_for_url_file):
+                data = self._read_url_file()
+
+        if data is None:
             self.log.fatal("Fatal: url file never arrived: %s", self.url_file)
             self.exit(1)
+        self.load_connector_file(data)
 
-        exec_lines = []
-        for app in ('IPKernelApp', 'InteractiveShellApp'):
-            if '%s.exec_lines' % app in config:
-                exec_lines = config[app].exec_lines
-                break
-
-        exec_files = []
+        # exec_lines/files may be configured on either app, IPKernelApp first
+        exec_lines = exec_files = None
         for app in ('IPKernelApp', 'InteractiveShellApp'):
-            if '%s.exec_files' % app in config:
-                exec_files = config[app].exec_files
-                break
+            app_config = config.get(app)
+            if not app_config:
+                continue
+            if exec_lines is None and 'exec_lines' in app_config:
+                exec_lines = app_config.exec_lines
+            if exec_files is None and 'exec_files' in app_config:
+                exec_files = app_config.exec_files
+        if exec_lines is None:
+            exec_lines = []
+        if exec_files is None:
+            exec_files = []
 
         config.IPKernelApp.exec_lines = exec_lines
         config.IPKernelApp.exec_files = exec_files
@@ -300,29 +471,70 @@ class IPEngineApp(BaseParallelApplication):
         # Create the underlying shell class and Engine
         # shell_class = import_item(self.master_config.Global.shell_class)
         # print self.config
+        from ipyparallel.engine.engine import EngineFactory
+
         try:
             self.engine = EngineFactory(
                 config=config,
                 log=self.log,
+                context=zmq.Context.instance(io_threads=self.io_threads),
                 connection_info=self.connection_info,
             )
         except:
             self.log.error("Couldn't start the Engine", exc_info=True)
             self.exit(1)
 
+    # the handler forwarding logs to log_url, if any
+    _log_pub_handler = None
+
     def forward_logging(self):
-        if self.log_url:
+        if self.log_url and self._log_pub_handler is None:
             self.log.info("Forwarding logging to %s", self.log_url)
             context = self.engine.context
             lsock = context.socket(zmq.PUB)
+            # buffer bursts of log output, and keep idle connections
+            # to a remote logger alive through NAT and firewall timeouts
+            lsock.setsockopt(zmq.SNDHWM, 100000)
+            lsock.setsockopt(zmq.TCP_KEEPALIVE, 1)
+            lsock.setsockopt(zmq.TCP_KEEPALIVE_IDLE, 60)
             lsock.connect(self.log_url)
             handler = EnginePUBHandler(self.engine, lsock)
             handler.setLevel(self.log_level)
             self.log.addHandler(handler)
+            self._log_pub_handler = handler
+
+    def stop_forwarding_logging(self):
+        """Remove the log forwarding handler and close its socket"""
+        handler = self._log_pub_handler
+        if handler is None:
+            return
+        self._log_pub_handler = None
+        self.log.removeHandler(handler)
+        # allow a moment to deliver the last messages
+        handler.socket.close(linger=1000)
+
+    def init_uvloop(self):
+        """Use uvloop for the event loop, if it is enabled and installed
+
+        Must be called before the engine's loop is created.
+        """
+        if not self.use_uvloop:
+            return
+        try:
+            import uvloop
+        except ImportError:
+            return
+        import asyncio
+
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        # recent uvloop policies don't create loops on demand
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        self.log.info("Using uvloop event loop")
 
     @catch_config_error
     def initialize(self, argv=None):
         super(IPEngineApp, self).initialize(argv)
+        self.init_uvloop()
         self.init_engine()
         self.forward_logging()
 
@@ -332,9 +544,19 @@ class IPEngineApp(BaseParallelApplication):
             self.engine.loop.start()
         except KeyboardInterrupt:
             self.log.critical("Engine Interrupted, shutting down...\n")
+        finally:
+            self.stop_forwarding_logging()
+
 
+def launch_new_instance(argv=None, **kwargs):
+    """Launch an engine
 
-launch_new_instance = IPEngineApp.launch_instance
+    If the IPP_PREWARM environment variable is set,
+    library files are prefetched in the background while the engine starts.
+    """
+    if os.environ.get('IPP_PREWARM'):
+        threading.Thread(target=_prefetch_package_files, daemon=True).start()
+    return IPEngineApp.launch_instance(argv, **kwargs)
 
 
 if __name__ == '__main__':
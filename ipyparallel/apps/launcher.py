@@ -2,13 +2,14 @@
 """Facilities for launching IPython processes asynchronously."""
 # Copyright (c) IPython Development Team.
 # Distributed under the terms of the Modified BSD License.
-import copy
 import logging
 import os
-import pipes
+import shlex
 import stat
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from signal import SIGINT
 from signal import SIGTERM
 
@@ -25,7 +26,7 @@ try:
 except ImportError:
     pass
 
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, CalledProcessError
 
 try:
     from subprocess import check_output
@@ -42,6 +43,7 @@ from traitlets.config.configurable import LoggingConfigurable
 from IPython.utils.text import EvalFormatter
 from traitlets import (
     Any,
+    Bool,
     Integer,
     CFloat,
     List,
@@ -89,6 +91,19 @@ if WINDOWS and sys.version_info < (3,):
         "from ipyparallel.controller.__main__ import main; main()",
     ]
 
+
+def _pidfd_open(pid):
+    """Return a pidfd for pid, or None if pidfds are unavailable."""
+    if not hasattr(os, 'pidfd_open'):
+        # Python < 3.9, or not Linux
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        # kernel < 5.3
+        return None
+
+
 # -----------------------------------------------------------------------------
 # Base launchers and errors
 # -----------------------------------------------------------------------------
@@ -129,6 +144,7 @@ class BaseLauncher(LoggingConfigurable):
         super(BaseLauncher, self).__init__(work_dir=work_dir, config=config, **kwargs)
         self.state = 'before'  # can be before, running, after
         self.stop_callbacks = []
+        self._args_cache = None
 
     @property
     def args(self):
@@ -136,8 +152,11 @@ class BaseLauncher(LoggingConfigurable):
 
         This is what is passed to :func:`spawnProcess` and the first element
         will be the process name.
+        While the process is running, this is the list it was started with.
         """
-        return self.find_args()
+        if self._args_cache is None:
+            return self.find_args()
+        return self._args_cache
 
     def find_args(self):
         """The ``.args`` property calls this to find the args list.
@@ -199,11 +218,12 @@ class BaseLauncher(LoggingConfigurable):
         this to trigger callbacks registered via :meth:`on_stop`."""
 
         self.log.debug('Process %r stopped: %r', self.args[0], data)
+        self._args_cache = None
         self.stop_data = data
         self.state = 'after'
-        for i in range(len(self.stop_callbacks)):
-            d = self.stop_callbacks.pop()
-            d(data)
+        callbacks, self.stop_callbacks = self.stop_callbacks, []
+        for f in callbacks:
+            f(data)
         return data
 
     def signal(self, sig):
@@ -270,6 +290,8 @@ class LocalProcessLauncher(BaseLauncher):
     # spawnProcess.
     cmd_and_args = List([])
     poll_frequency = Integer(100)  # in ms
+    # whether the launcher writes to the process's stdin
+    stdin_pipe = False
 
     def __init__(self, work_dir=u'.', config=None, **kwargs):
         super(LocalProcessLauncher, self).__init__(
@@ -277,6 +299,10 @@ class LocalProcessLauncher(BaseLauncher):
         )
         self.process = None
         self.poller = None
+        self.killer = None
+        self._pidfd = None
+        self._stdout_buf = bytearray()
+        self._stderr_buf = bytearray()
 
     def find_args(self):
         return self.cmd_and_args
@@ -284,12 +310,13 @@ class LocalProcessLauncher(BaseLauncher):
     def start(self):
         self.log.debug("Starting %s: %r", self.__class__.__name__, self.args)
         if self.state == 'before':
+            # args don't change once the process is started
+            self._args_cache = self.find_args()
             self.process = Popen(
                 self.args,
                 stdout=PIPE,
                 stderr=PIPE,
-                stdin=PIPE,
-                env=os.environ,
+                stdin=PIPE if self.stdin_pipe else DEVNULL,
                 cwd=self.work_dir,
             )
             if WINDOWS:
@@ -300,8 +327,14 @@ class LocalProcessLauncher(BaseLauncher):
                 self.stderr = self.process.stderr.fileno()
             self.loop.add_handler(self.stdout, self.handle_stdout, self.loop.READ)
             self.loop.add_handler(self.stderr, self.handle_stderr, self.loop.READ)
-            self.poller = ioloop.PeriodicCallback(self.poll, self.poll_frequency)
-            self.poller.start()
+            self._pidfd = _pidfd_open(self.process.pid)
+            if self._pidfd is not None:
+                # the pidfd becomes readable when the process exits,
+                # so there is no need to wake up periodically to poll it
+                self.loop.add_handler(self._pidfd, self.handle_exit, self.loop.READ)
+            else:
+                self.poller = ioloop.PeriodicCallback(self.poll, self.poll_frequency)
+                self.poller.start()
             self.notify_start(self.process.pid)
         else:
             s = 'The process was already started and has state: %r' % self.state
@@ -319,46 +352,88 @@ class LocalProcessLauncher(BaseLauncher):
                 self.process.send_signal(sig)
 
     def interrupt_then_kill(self, delay=2.0):
-        """Send INT, wait a delay and then send KILL."""
+        """Send INT, wait a delay and then send KILL if it is still running."""
         try:
             self.signal(SIGINT)
         except Exception:
             self.log.debug("interrupt failed")
             pass
         self.killer = self.loop.add_timeout(
-            self.loop.time() + delay, lambda: self.signal(SIGKILL)
+            self.loop.time() + delay, self._kill_if_running
         )
 
+    def _kill_if_running(self):
+        self.killer = None
+        if self.process.poll() is None:
+            self.signal(SIGKILL)
+
+    def notify_stop(self, data):
+        if self.killer is not None:
+            # stopped before the kill timer fired
+            self.loop.remove_timeout(self.killer)
+            self.killer = None
+        return super(LocalProcessLauncher, self).notify_stop(data)
+
     # callbacks, etc:
 
     def handle_stdout(self, fd, events):
-        if WINDOWS:
-            line = self.stdout.recv().decode('utf8', 'replace')
-        else:
-            line = self.process.stdout.readline().decode('utf8', 'replace')
-        # a stopped process will be readable but return empty strings
-        if line:
-            self.log.debug(line.rstrip())
-        else:
-            self.poll()
+        self._handle_output(self.stdout, self._stdout_buf)
 
     def handle_stderr(self, fd, events):
+        self._handle_output(self.stderr, self._stderr_buf)
+
+    def _handle_output(self, stream, buf):
+        """Read available output and log complete lines at debug level
+
+        Output is read in large chunks, and is only decoded
+        if it is going to be logged.
+        """
         if WINDOWS:
-            line = self.stderr.recv().decode('utf8', 'replace')
+            data = stream.recv()
         else:
-            line = self.process.stderr.readline().decode('utf8', 'replace')
+            data = os.read(stream, 65536)
         # a stopped process will be readable but return empty strings
-        if line:
-            self.log.debug(line.rstrip())
-        else:
+        if not data:
+            if not WINDOWS:
+                self.loop.remove_handler(stream)
+            self._flush_output(buf)
             self.poll()
+            return
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return
+        buf.extend(data)
+        end = buf.rfind(b'\n')
+        if end < 0:
+            if len(buf) < 65536:
+                # wait for the rest of the line
+                return
+            end = len(buf)
+        for line in bytes(buf[:end]).split(b'\n'):
+            self.log.debug(line.decode('utf8', 'replace').rstrip())
+        del buf[: end + 1]
+
+    def _flush_output(self, buf):
+        """Log a last line of output left without a trailing newline"""
+        if buf:
+            self.log.debug(bytes(buf).decode('utf8', 'replace').rstrip())
+            del buf[:]
+
+    def handle_exit(self, fd, events):
+        self.poll()
 
     def poll(self):
         status = self.process.poll()
-        if status is not None:
-            self.poller.stop()
+        if status is not None and self.state != 'after':
+            if self._pidfd is not None:
+                self.loop.remove_handler(self._pidfd)
+                os.close(self._pidfd)
+                self._pidfd = None
+            if self.poller is not None:
+                self.poller.stop()
             self.loop.remove_handler(self.stdout)
             self.loop.remove_handler(self.stderr)
+            self._flush_output(self._stdout_buf)
+            self._flush_output(self._stderr_buf)
             self.notify_stop(dict(exit_code=status, pid=self.process.pid))
         return status
 
@@ -397,6 +472,9 @@ class LocalEngineSetLauncher(LocalEngineLauncher):
 
     launchers = Dict()
     stop_data = Dict()
+    _pending_starts = Dict()
+    # map of process pid to key in launchers
+    _pid_to_idx = Dict()
 
     def __init__(self, work_dir=u'.', config=None, **kwargs):
         super(LocalEngineSetLauncher, self).__init__(
@@ -404,58 +482,131 @@ class LocalEngineSetLauncher(LocalEngineLauncher):
         )
 
     def start(self, n):
-        """Start n engines by profile or profile_dir."""
+        """Start n engines by profile or profile_dir.
+
+        The first engine is started immediately.
+        If there is a delay, the rest are scheduled on the loop
+        to start ``delay`` seconds apart, rather than blocking it.
+        """
         dlist = []
+        self._pending_starts = {}
         for i in range(n):
-            if i > 0:
-                time.sleep(self.delay)
-            el = self.launcher_class(
-                work_dir=self.work_dir,
-                parent=self,
-                log=self.log,
-                profile_dir=self.profile_dir,
-                cluster_id=self.cluster_id,
-            )
-
-            # Copy the engine args over to each engine launcher.
-            el.engine_cmd = copy.deepcopy(self.engine_cmd)
-            el.engine_args = copy.deepcopy(self.engine_args)
-            el.on_stop(self._notice_engine_stopped)
-            d = el.start()
-            self.launchers[i] = el
-            dlist.append(d)
+            if i > 0 and self.delay:
+                self._pending_starts[i] = self.loop.call_later(
+                    i * self.delay, self._start_one, i
+                )
+            else:
+                dlist.append(self._start_one(i))
         self.notify_start(dlist)
         return dlist
 
+    def _start_one(self, i):
+        """Start the i-th engine"""
+        self._pending_starts.pop(i, None)
+        el = self.launcher_class(
+            work_dir=self.work_dir,
+            parent=self,
+            log=self.log,
+            loop=self.loop,
+            profile_dir=self.profile_dir,
+            cluster_id=self.cluster_id,
+        )
+
+        # Copy the engine args over to each engine launcher.
+        el.engine_cmd = list(self.engine_cmd)
+        el.engine_args = list(self.engine_args)
+        el.on_stop(self._notice_engine_stopped)
+        d = el.start()
+        self._add_launcher(i, el)
+        return d
+
+    def _add_launcher(self, key, el):
+        """Track a started engine launcher under key"""
+        self.launchers[key] = el
+        self._pid_to_idx[el.process.pid] = key
+
+    def _cancel_pending_starts(self):
+        """Cancel any engine starts that have not happened yet"""
+        for handle in self._pending_starts.values():
+            self.loop.remove_timeout(handle)
+        self._pending_starts = {}
+
     def find_args(self):
         return ['engine set']
 
     def signal(self, sig):
+        if WINDOWS and sig != SIGINT and self._can_tree_kill:
+            running = [el for el in itervalues(self.launchers) if el.running]
+            self._tree_kill(running)
+            return [None] * len(running)
         dlist = []
         for el in itervalues(self.launchers):
             d = el.signal(sig)
             dlist.append(d)
         return dlist
 
+    @property
+    def _can_tree_kill(self):
+        """Whether our engines are local processes that taskkill can stop"""
+        return issubclass(self.launcher_class, LocalEngineLauncher)
+
+    def _tree_kill(self, launchers):
+        """Kill the process trees of launchers with one taskkill on Windows,
+        rather than one taskkill per engine.
+        """
+        if not launchers:
+            return
+        cmd = ['taskkill']
+        for el in launchers:
+            cmd.extend(['-pid', str(el.process.pid)])
+        try:
+            check_output(cmd + ['-t', '-f'])
+        except CalledProcessError as e:
+            # some of the engines may have exited in the meantime
+            self.log.debug("taskkill failed: %s", e)
+
     def interrupt_then_kill(self, delay=1.0):
+        if self._pending_starts:
+            self._cancel_pending_starts()
+            if not self.launchers and self.state == 'running':
+                # every engine that was started has already stopped
+                self.notify_stop(self.stop_data)
         dlist = []
         for el in itervalues(self.launchers):
-            d = el.interrupt_then_kill(delay)
+            try:
+                d = el.signal(SIGINT)
+            except Exception:
+                self.log.debug("interrupt failed")
+                d = None
             dlist.append(d)
+        # one timer for the whole set, rather than one per engine
+        self.killer = self.loop.add_timeout(
+            self.loop.time() + delay, self._kill_if_running
+        )
         return dlist
 
+    def _kill_if_running(self):
+        self.killer = None
+        if WINDOWS and self._can_tree_kill:
+            self._tree_kill(
+                [el for el in itervalues(self.launchers) if el.process.poll() is None]
+            )
+            return
+        for el in list(itervalues(self.launchers)):
+            el._kill_if_running()
+
     def stop(self):
         return self.interrupt_then_kill()
 
     def _notice_engine_stopped(self, data):
-        pid = data['pid']
-        for idx, el in iteritems(self.launchers):
-            if el.process.pid == pid:
-                break
-        if self.launchers:
-            self.launchers.pop(idx)
-            self.stop_data[idx] = data
-        else:
+        idx = self._pid_to_idx.pop(data['pid'], None)
+        if idx is None:
+            # not one of ours, or already noticed
+            return
+        self.launchers.pop(idx)
+        self.stop_data[idx] = data
+        if not self.launchers and not self._pending_starts:
+            # all engines have stopped
             self.notify_stop(self.stop_data)
 
 
@@ -590,6 +741,14 @@ class MPIExecEngineSetLauncher(MPIEngineSetLauncher, DeprecatedMPILauncher):
 
 # TODO: Get SSH Launcher back to level of sshx in 0.10.2
 
+# share one connection per host between the ssh and scp calls
+# of all the launchers, rather than handshaking for each one
+ssh_control_args = [
+    '-oControlMaster=auto',
+    '-oControlPersist=60s',
+    '-oControlPath=~/.ssh/ipp-%C',
+]
+
 
 class SSHLauncher(LocalProcessLauncher):
     """A minimal launcher for ssh.
@@ -599,10 +758,22 @@ class SSHLauncher(LocalProcessLauncher):
     as well.
     """
 
+    # signal() writes the ssh escape sequence to stdin
+    stdin_pipe = True
+
     ssh_cmd = List(['ssh'], config=True, help="command for starting ssh")
     ssh_args = List(['-tt'], config=True, help="args to pass to ssh")
     scp_cmd = List(['scp'], config=True, help="command for sending files")
     scp_args = List([], config=True, help="args to pass to scp")
+    ssh_multiplex = Bool(
+        False,
+        config=True,
+        help="""Share one ssh connection per host between ssh and scp calls.
+
+        Requires OpenSSH 6.7 or newer, and is not supported on Windows.
+        The shared connection is closed with `ssh -O exit` when the launcher
+        is stopped.""",
+    )
     program = List(['date'], help="Program to launch via ssh")
     program_args = List([], help="args to pass to remote program")
     hostname = Unicode('', config=True, help="hostname on which to launch the program")
@@ -628,32 +799,45 @@ class SSHLauncher(LocalProcessLauncher):
     def _user_changed(self, change):
         self.location = u'%s@%s' % (change['new'], self.hostname)
 
+    # set by stop(), so only a requested stop closes the shared connection
+    _stop_requested = False
+
+    @property
+    def _control_args(self):
+        """ssh options for sharing a connection, if enabled"""
+        if self.ssh_multiplex and not WINDOWS:
+            return ssh_control_args
+        return []
+
     def find_args(self):
         return (
             self.ssh_cmd
             + self.ssh_args
+            + self._control_args
             + [self.location]
-            + list(map(pipes.quote, self.program + self.program_args))
+            + list(map(shlex.quote, self.program + self.program_args))
         )
 
     def _send_file(self, local, remote):
         """send a single file"""
         full_remote = "%s:%s" % (self.location, remote)
-        for i in range(10):
-            if not os.path.exists(local):
-                self.log.debug("waiting for %s" % local)
-                time.sleep(1)
-            else:
-                break
+        # wait up to 10s for local file to exist
+        deadline = time.monotonic() + 10
+        while not os.path.exists(local) and time.monotonic() < deadline:
+            self.log.debug("waiting for %s" % local)
+            time.sleep(0.1)
         remote_dir = os.path.dirname(remote)
         self.log.info("ensuring remote %s:%s/ exists", self.location, remote_dir)
         check_output(
             self.ssh_cmd
             + self.ssh_args
+            + self._control_args
             + [self.location, 'mkdir', '-p', '--', remote_dir]
         )
         self.log.info("sending %s to %s", local, full_remote)
-        check_output(self.scp_cmd + self.scp_args + [local, full_remote])
+        check_output(
+            self.scp_cmd + self.scp_args + self._control_args + [local, full_remote]
+        )
 
     def send_files(self):
         """send our files (called before start)"""
@@ -666,21 +850,27 @@ class SSHLauncher(LocalProcessLauncher):
         """fetch a single file"""
         full_remote = "%s:%s" % (self.location, remote)
         self.log.info("fetching %s from %s", local, full_remote)
-        for i in range(10):
-            # wait up to 10s for remote file to exist
-            check = check_output(
+        # wait up to 10s for remote file to exist,
+        # waiting on the remote side so it only takes one ssh call
+        wait_for_remote = (
+            'for i in 1 2 3 4 5 6 7 8 9 10; do '
+            'test -e %s && exit 0; sleep 1; '
+            'done; exit 1' % shlex.quote(remote)
+        )
+        try:
+            check_output(
                 self.ssh_cmd
                 + self.ssh_args
-                + [self.location, 'test -e', remote, "&& echo 'yes' || echo 'no'"]
+                + self._control_args
+                + [self.location, wait_for_remote]
             )
-            check = check.decode(DEFAULT_ENCODING, 'replace').strip()
-            if check == u'no':
-                time.sleep(1)
-            elif check == u'yes':
-                break
+        except CalledProcessError:
+            self.log.warning("%s did not appear after 10s", full_remote)
         local_dir = os.path.dirname(local)
         ensure_dir_exists(local_dir, 775)
-        check_output(self.scp_cmd + [full_remote, local])
+        check_output(
+            self.scp_cmd + self.scp_args + self._control_args + [full_remote, local]
+        )
 
     def fetch_files(self):
         """fetch remote files (called after start)"""
@@ -689,7 +879,8 @@ class SSHLauncher(LocalProcessLauncher):
         for remote_file, local_file in self.to_fetch:
             self._fetch_file(remote_file, local_file)
 
-    def start(self, hostname=None, user=None, port=None):
+    def setup_ssh(self, hostname=None, user=None, port=None):
+        """Set where to connect to (called before sending files)"""
         if hostname is not None:
             self.hostname = hostname
         if user is not None:
@@ -700,10 +891,41 @@ class SSHLauncher(LocalProcessLauncher):
             self.scp_args.append('-P')
             self.scp_args.append(port)
 
+        if self._control_args:
+            # ssh needs the directory for the ControlPath socket to exist
+            ensure_dir_exists(os.path.join(get_home_dir(), '.ssh'), 0o700)
+
+    def start(self, hostname=None, user=None, port=None):
+        self.setup_ssh(hostname=hostname, user=user, port=port)
         self.send_files()
         super(SSHLauncher, self).start()
         self.fetch_files()
 
+    def stop(self):
+        self._stop_requested = True
+        return super(SSHLauncher, self).stop()
+
+    def notify_stop(self, data):
+        if self._stop_requested:
+            self.close_connection()
+        return super(SSHLauncher, self).notify_stop(data)
+
+    def close_connection(self):
+        """Close the shared connection to our host, if there is one"""
+        if not self._control_args:
+            return
+        try:
+            check_output(
+                self.ssh_cmd
+                + self.ssh_args
+                + self._control_args
+                + ['-O', 'exit', self.location],
+                stderr=STDOUT,
+            )
+        except (CalledProcessError, OSError) as e:
+            # not connected, e.g. the master has already exited
+            self.log.debug("No ssh connection to close for %s: %s", self.location, e)
+
     def signal(self, sig):
         if self.state == 'running':
             # send escaped ssh connection-closer
@@ -783,6 +1005,14 @@ class SSHControllerLauncher(SSHClusterLauncher, ControllerMixin):
 
 class SSHEngineLauncher(SSHClusterLauncher, EngineMixin):
 
+    n = Integer(
+        1,
+        help="""The number of engines to start on the host.
+
+        If more than one, they are all started from a single ssh session.""",
+    )
+    delay = CFloat(0, help="delay (in seconds) between starting each engine")
+
     # alias back to *non-configurable* program[_args] for use in find_args()
     # this way all Controller/EngineSetLaunchers have the same form, rather
     # than *some* having `program_args` and others `controller_args`
@@ -798,6 +1028,24 @@ class SSHEngineLauncher(SSHClusterLauncher, EngineMixin):
     def program_args(self):
         return self.cluster_args + self.engine_args
 
+    def find_args(self):
+        if self.n <= 1:
+            return super(SSHEngineLauncher, self).find_args()
+        # start all n engines in the background of one remote shell,
+        # which waits for them to exit
+        cmd = ' '.join(map(shlex.quote, self.program + self.program_args))
+        if self.delay:
+            sep = ' & sleep %g; ' % self.delay
+        else:
+            sep = ' & '
+        script = sep.join([cmd] * self.n) + ' & wait'
+        return (
+            self.ssh_cmd
+            + self.ssh_args
+            + self._control_args
+            + [self.location, 'sh', '-c', shlex.quote(script)]
+        )
+
     def _to_send_default(self):
         return [
             (
@@ -815,6 +1063,19 @@ class SSHEngineSetLauncher(LocalEngineSetLauncher):
         help="""dict of engines to launch.  This is a dict by hostname of ints,
         corresponding to the number of engines to start on that host.""",
     )
+    batch = Bool(
+        False,
+        config=True,
+        help="""Start all the engines on a host from a single ssh session,
+        rather than one ssh session per engine.
+
+        When batched, the launcher for each host is stored under the host name,
+        and its stop data covers all of the engines on that host.""",
+    )
+
+    # the first launcher on each host, for closing shared connections
+    _host_launchers = List()
+    _stop_requested = False
 
     def _engine_cmd_default(self):
         return ['ipengine']
@@ -831,12 +1092,49 @@ class SSHEngineSetLauncher(LocalEngineSetLauncher):
             count += n
         return count
 
+    def _new_launcher(self, cmd, args, **kwargs):
+        el = self.launcher_class(
+            work_dir=self.work_dir,
+            parent=self,
+            log=self.log,
+            loop=self.loop,
+            profile_dir=self.profile_dir,
+            cluster_id=self.cluster_id,
+            **kwargs,
+        )
+        # Copy the engine args over to each engine launcher.
+        el.engine_cmd = cmd
+        el.engine_args = args
+        el.on_stop(self._notice_engine_stopped)
+        return el
+
+    def _send_files(self, launchers):
+        """Send files for each launcher concurrently
+
+        Returns the set of indices of launchers whose files could not be sent.
+        """
+        failed = set()
+        if not launchers:
+            return failed
+        with ThreadPoolExecutor(max_workers=min(len(launchers), 32)) as pool:
+            futures = [pool.submit(el.send_files) for el in launchers]
+        for i, (el, f) in enumerate(zip(launchers, futures)):
+            e = f.exception()
+            if e is not None:
+                self.log.error(
+                    "Failed to send files to %s, not starting engines there: %s",
+                    el.location,
+                    e,
+                )
+                failed.add(i)
+        return failed
+
     def start(self, n):
         """Start engines by profile or profile_dir.
         `n` is ignored, and the `engines` config property is used instead.
         """
 
-        dlist = []
+        hosts = []
         for host, n in iteritems(self.engines):
             cmd = None
             args = None
@@ -854,9 +1152,9 @@ class SSHEngineSetLauncher(LocalEngineSetLauncher):
                 if 'engine_cmd' in cdict:
                     cmd = cdict['engine_cmd']
             if args is None:
-                args = copy.deepcopy(self.engine_args)
+                args = list(self.engine_args)
             if cmd is None:
-                cmd = copy.deepcopy(self.engine_cmd)
+                cmd = list(self.engine_cmd)
 
             if '@' in host:
                 user, host = host.split('@', 1)
@@ -867,31 +1165,59 @@ class SSHEngineSetLauncher(LocalEngineSetLauncher):
             else:
                 port = None
 
-            for i in range(n):
-                if i > 0:
-                    time.sleep(self.delay)
-                el = self.launcher_class(
-                    work_dir=self.work_dir,
-                    parent=self,
-                    log=self.log,
-                    profile_dir=self.profile_dir,
-                    cluster_id=self.cluster_id,
-                )
-                if i > 0:
-                    # only send files for the first engine on each host
-                    el.to_send = []
-
-                # Copy the engine args over to each engine launcher.
-                el.engine_cmd = cmd
-                el.engine_args = args
-                el.on_stop(self._notice_engine_stopped)
+            if n < 1:
+                continue
+            if self.batch and n > 1:
+                el = self._new_launcher(cmd, args, n=n, delay=self.delay)
+            else:
+                el = self._new_launcher(cmd, args)
+            el.setup_ssh(user=user, hostname=host, port=port)
+            hosts.append((host, user, port, n, cmd, args, el))
+
+        # send files to all the hosts at once, rather than one after another
+        failed = self._send_files([el for *_, el in hosts])
+
+        dlist = []
+        n_skipped = 0
+        for idx, (host, user, port, n, cmd, args, el) in enumerate(hosts):
+            if idx in failed:
+                n_skipped += n
+                continue
+            # files have been sent
+            el.to_send = []
+            d = el.start()
+            dlist.append(d)
+            self._host_launchers.append(el)
+            if self.batch and n > 1:
+                self._add_launcher(host, el)
+                continue
+            self._add_launcher("%s/0" % host, el)
+
+            for i in range(1, n):
+                time.sleep(self.delay)
+                el = self._new_launcher(cmd, args)
+                # only send files for the first engine on each host
+                el.to_send = []
                 d = el.start(user=user, hostname=host, port=port)
-                self.launchers["%s/%i" % (host, i)] = el
+                self._add_launcher("%s/%i" % (host, i), el)
                 dlist.append(d)
         self.notify_start(dlist)
-        self.n = self.engine_count
+        # don't count the engines on hosts we couldn't send files to
+        self.n = self.engine_count - n_skipped
         return dlist
 
+    def stop(self):
+        self._stop_requested = True
+        return super(SSHEngineSetLauncher, self).stop()
+
+    def notify_stop(self, data):
+        if self._stop_requested:
+            # the engines on a host share one connection,
+            # so close it once they have all stopped
+            for el in self._host_launchers:
+                el.close_connection()
+        return super(SSHEngineSetLauncher, self).notify_stop(data)
+
 
 class SSHProxyEngineSetLauncher(SSHClusterLauncher):
     """Launcher for calling
@@ -931,6 +1257,7 @@ class SSHProxyEngineSetLauncher(SSHClusterLauncher):
 
 
 # This is only used on Windows.
+@lru_cache(maxsize=1)
 def find_job_cmd():
     if WINDOWS:
         try:
@@ -961,9 +1288,10 @@ class WindowsHPCLauncher(BaseLauncher):
     scheduler = Unicode(
         '', config=True, help="The hostname of the scheduler to submit the job to."
     )
-    job_cmd = Unicode(
-        find_job_cmd(), config=True, help="The command for submitting jobs."
-    )
+    job_cmd = Unicode(config=True, help="The command for submitting jobs.")
+
+    def _job_cmd_default(self):
+        return find_job_cmd()
 
     def __init__(self, work_dir=u'.', config=None, **kwargs):
         super(WindowsHPCLauncher, self).__init__(
@@ -1003,9 +1331,7 @@ class WindowsHPCLauncher(BaseLauncher):
             "Starting Win HPC Job: %s" % (self.job_cmd + ' ' + ' '.join(args),)
         )
 
-        output = check_output(
-            [self.job_cmd] + args, env=os.environ, cwd=self.work_dir, stderr=STDOUT
-        )
+        output = check_output([self.job_cmd] + args, cwd=self.work_dir, stderr=STDOUT)
         output = output.decode(DEFAULT_ENCODING, 'replace')
         job_id = self.parse_job_id(output)
         self.notify_start(job_id)
@@ -1018,7 +1344,7 @@ class WindowsHPCLauncher(BaseLauncher):
         )
         try:
             output = check_output(
-                [self.job_cmd] + args, env=os.environ, cwd=self.work_dir, stderr=STDOUT
+                [self.job_cmd] + args, cwd=self.work_dir, stderr=STDOUT
             )
             output = output.decode(DEFAULT_ENCODING, 'replace')
         except:
@@ -1099,6 +1425,28 @@ class WindowsHPCEngineSetLauncher(WindowsHPCLauncher, ClusterAppMixin):
 # -----------------------------------------------------------------------------
 
 
+def _cmd_line(argv):
+    """Quote a command for use in a batch script"""
+    return ' '.join(map(shlex.quote, argv))
+
+
+# EvalFormatter has no state, so all batch launchers can share one
+_batch_formatter = EvalFormatter()
+
+# cache of batch template files, by path: (mtime_ns, contents)
+_template_file_cache = {}
+
+
+def _read_template_file(path):
+    """Read a batch template file, reusing the contents until it is modified"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _template_file_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = _template_file_cache[path] = (mtime, f.read())
+    return cached[1]
+
+
 class BatchClusterAppMixin(ClusterAppMixin):
     """ClusterApp mixin that updates the self.context dict, rather than cl-args."""
 
@@ -1213,7 +1561,10 @@ class BatchSystemLauncher(BaseLauncher):
         self.context[change['name']] = change['new']
 
     # the Formatter instance for rendering the templates:
-    formatter = Instance(EvalFormatter, (), {})
+    formatter = Instance(EvalFormatter)
+
+    def _formatter_default(self):
+        return _batch_formatter
 
     def find_args(self):
         return self.submit_command + [self.batch_file]
@@ -1241,8 +1592,7 @@ class BatchSystemLauncher(BaseLauncher):
         # first priority is batch_template if set
         if self.batch_template_file and not self.batch_template:
             # second priority is batch_template_file
-            with open(self.batch_template_file) as f:
-                self.batch_template = f.read()
+            self.batch_template = _read_template_file(self.batch_template_file)
         if not self.batch_template:
             # third (last) priority is default_template
             self.batch_template = self.default_template
@@ -1257,9 +1607,17 @@ class BatchSystemLauncher(BaseLauncher):
         ns.update(self.namespace)
         script_as_string = self.formatter.format(self.batch_template, **ns)
         self.log.debug('Writing batch script: %s', self.batch_file)
-        with open(self.batch_file, 'w') as f:
+        mode = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
+        # create the file with its mode, rather than chmod-ing it by path after
+        fd = os.open(self.batch_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with open(fd, 'w') as f:
+            if hasattr(os, 'fchmod'):
+                # the mode passed to open only applies if the file is new
+                os.fchmod(fd, mode)
             f.write(script_as_string)
-        os.chmod(self.batch_file, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+        if not hasattr(os, 'fchmod'):
+            # Windows
+            os.chmod(self.batch_file, mode)
 
     def _insert_options_in_script(self):
         """Inserts a queue if required into the batch script."""
@@ -1281,7 +1639,7 @@ class BatchSystemLauncher(BaseLauncher):
         # Here we save profile_dir in the context so they
         # can be used in the batch script template as {profile_dir}
         self.write_batch_script(n)
-        output = check_output(self.args, env=os.environ)
+        output = check_output(self.args)
         output = output.decode(DEFAULT_ENCODING, 'replace')
 
         job_id = self.parse_job_id(output)
@@ -1292,7 +1650,6 @@ class BatchSystemLauncher(BaseLauncher):
         try:
             p = Popen(
                 self.delete_command + [self.job_id],
-                env=os.environ,
                 stdout=PIPE,
                 stderr=PIPE,
             )
@@ -1335,14 +1692,15 @@ class PBSControllerLauncher(PBSLauncher, BatchClusterAppMixin):
     batch_file_name = Unicode(
         u'pbs_controller', config=True, help="batch file name for the controller job."
     )
-    default_template = Unicode(
-        """#!/bin/sh
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = """#!/bin/sh
 #PBS -V
 #PBS -N ipcontroller
 %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
 """
-        % (' '.join(map(pipes.quote, ipcontroller_cmd_argv)))
-    )
+        return template % _cmd_line(ipcontroller_cmd_argv)
 
     def start(self):
         """Start the controller by profile or profile_dir."""
@@ -1355,14 +1713,15 @@ class PBSEngineSetLauncher(PBSLauncher, BatchClusterAppMixin):
     batch_file_name = Unicode(
         u'pbs_engines', config=True, help="batch file name for the engine(s) job."
     )
-    default_template = Unicode(
-        u"""#!/bin/sh
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = u"""#!/bin/sh
 #PBS -V
 #PBS -N ipengine
 %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
 """
-        % (' '.join(map(pipes.quote, ipengine_cmd_argv)))
-    )
+        return template % _cmd_line(ipengine_cmd_argv)
 
 
 # Slurm is very similar to PBS
@@ -1395,6 +1754,16 @@ class SlurmLauncher(BatchSystemLauncher):
 
     options = Unicode(u"", config=True, help="Extra Slurm options")
 
+    wait = Bool(
+        False,
+        config=True,
+        help="""Submit with `sbatch --wait --parsable`.
+
+        sbatch then keeps running until the job ends,
+        so the launcher is notified when the job exits
+        rather than only when it is stopped.""",
+    )
+
     @observe('account')
     def _account_changed(self, change):
         self._update_context(change)
@@ -1428,27 +1797,73 @@ class SlurmLauncher(BatchSystemLauncher):
     timelimit_regexp = CRegExp(r'#SBATCH\W+(?:--time|-t)\W+\$?\w+')
     timelimit_template = Unicode('#SBATCH --time={timelimit}')
 
-    def _insert_options_in_script(self):
-        """Insert 'partition' (slurm name for queue), 'account', 'time' and other options if necessary"""
-        if self.queue and not self.queue_regexp.search(self.batch_template):
-            self.log.debug("adding slurm queue settings to batch script")
-            firstline, rest = self.batch_template.split('\n', 1)
-            self.batch_template = u'\n'.join([firstline, self.queue_template, rest])
+    def find_args(self):
+        if self.wait:
+            return self.submit_command + ['--wait', '--parsable', self.batch_file]
+        return super(SlurmLauncher, self).find_args()
 
-        if self.account and not self.account_regexp.search(self.batch_template):
-            self.log.debug("adding slurm account settings to batch script")
-            firstline, rest = self.batch_template.split('\n', 1)
-            self.batch_template = u'\n'.join([firstline, self.account_template, rest])
+    def start(self, n):
+        """Start n copies of the process using Slurm.
 
-        if self.qos and not self.qos_regexp.search(self.batch_template):
-            self.log.debug("adding Slurm qos settings to batch script")
-            firstline, rest = self.batch_template.split('\n', 1)
-            self.batch_template = u'\n'.join([firstline, self.qos_template, rest])
+        With `wait`, sbatch keeps running until the job ends,
+        and its exit is watched to notify that the job stopped.
+        """
+        if not self.wait:
+            return super(SlurmLauncher, self).start(n)
+        self.log.debug("Starting %s: %r", self.__class__.__name__, self.args)
+        self.write_batch_script(n)
+        self.process = Popen(self.args, stdout=PIPE, stderr=STDOUT)
+        # sbatch --parsable prints the job id as soon as the job is submitted
+        output = []
+        for line in self.process.stdout:
+            line = line.decode(DEFAULT_ENCODING, 'replace')
+            output.append(line)
+            if self.job_id_regexp.search(line):
+                break
+        job_id = self.parse_job_id(''.join(output))
+        self.loop.add_handler(
+            self.process.stdout.fileno(), self._handle_sbatch_output, self.loop.READ
+        )
+        self.notify_start(job_id)
+        return job_id
 
-        if self.timelimit and not self.timelimit_regexp.search(self.batch_template):
-            self.log.debug("adding slurm time limit settings to batch script")
+    def _handle_sbatch_output(self, fd, events):
+        data = self.process.stdout.read1(65536)
+        if data:
+            self.log.debug(
+                "sbatch %s: %s",
+                self.job_id,
+                data.decode(DEFAULT_ENCODING, 'replace').rstrip(),
+            )
+            return
+        # sbatch exits when the job does
+        self.loop.remove_handler(fd)
+        status = self.process.wait()
+        if self.state == 'running':
+            self.notify_stop(dict(job_id=self.job_id, exit_code=status))
+
+    def _insert_options_in_script(self):
+        """Insert 'partition' (slurm name for queue), 'account', 'time' and other options if necessary"""
+        inserts = []
+        for name, value, regexp, template in [
+            ('queue', self.queue, self.queue_regexp, self.queue_template),
+            ('account', self.account, self.account_regexp, self.account_template),
+            ('qos', self.qos, self.qos_regexp, self.qos_template),
+            (
+                'time limit',
+                self.timelimit,
+                self.timelimit_regexp,
+                self.timelimit_template,
+            ),
+        ]:
+            if value and not regexp.search(self.batch_template):
+                self.log.debug("adding slurm %s settings to batch script", name)
+                inserts.append(template)
+        if inserts:
+            # each option used to be inserted after the first line in turn,
+            # so the last one ends up first
             firstline, rest = self.batch_template.split('\n', 1)
-            self.batch_template = u'\n'.join([firstline, self.timelimit_template, rest])
+            self.batch_template = u'\n'.join([firstline] + inserts[::-1] + [rest])
 
 
 class SlurmControllerLauncher(SlurmLauncher, BatchClusterAppMixin):
@@ -1459,14 +1874,15 @@ class SlurmControllerLauncher(SlurmLauncher, BatchClusterAppMixin):
         config=True,
         help="batch file name for the controller job.",
     )
-    default_template = Unicode(
-        """#!/bin/sh
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = """#!/bin/sh
 #SBATCH --job-name=ipy-controller-{cluster_id}
 #SBATCH --ntasks=1
 %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
 """
-        % (' '.join(map(pipes.quote, ipcontroller_cmd_argv)))
-    )
+        return template % _cmd_line(ipcontroller_cmd_argv)
 
     def start(self):
         """Start the controller by profile or profile_dir."""
@@ -1481,13 +1897,14 @@ class SlurmEngineSetLauncher(SlurmLauncher, BatchClusterAppMixin):
         config=True,
         help="batch file name for the engine(s) job.",
     )
-    default_template = Unicode(
-        u"""#!/bin/sh
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = u"""#!/bin/sh
 #SBATCH --job-name=ipy-engine-{cluster_id}
 srun %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
 """
-        % (' '.join(map(pipes.quote, ipengine_cmd_argv)))
-    )
+        return template % _cmd_line(ipengine_cmd_argv)
 
 
 # SGE is very similar to PBS
@@ -1508,14 +1925,15 @@ class SGEControllerLauncher(SGELauncher, BatchClusterAppMixin):
     batch_file_name = Unicode(
         u'sge_controller', config=True, help="batch file name for the ipontroller job."
     )
-    default_template = Unicode(
-        u"""#$ -V
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = u"""#$ -V
 #$ -S /bin/sh
 #$ -N ipcontroller
 %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
 """
-        % (' '.join(map(pipes.quote, ipcontroller_cmd_argv)))
-    )
+        return template % _cmd_line(ipcontroller_cmd_argv)
 
     def start(self):
         """Start the controller by profile or profile_dir."""
@@ -1528,14 +1946,15 @@ class SGEEngineSetLauncher(SGELauncher, BatchClusterAppMixin):
     batch_file_name = Unicode(
         u'sge_engines', config=True, help="batch file name for the engine(s) job."
     )
-    default_template = Unicode(
-        """#$ -V
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = """#$ -V
 #$ -S /bin/sh
 #$ -N ipengine
 %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
 """
-        % (' '.join(map(pipes.quote, ipengine_cmd_argv)))
-    )
+        return template % _cmd_line(ipengine_cmd_argv)
 
 
 # LSF launchers
@@ -1569,10 +1988,16 @@ class LSFLauncher(BatchSystemLauncher):
         # Here we save profile_dir in the context so they
         # can be used in the batch script template as {profile_dir}
         self.write_batch_script(n)
-        piped_cmd = self.args[0] + '<\"' + self.args[1] + '\"'
-        self.log.debug("Starting %s: %s", self.__class__.__name__, piped_cmd)
-        p = Popen(piped_cmd, shell=True, env=os.environ, stdout=PIPE)
-        output, err = p.communicate()
+        self.log.debug(
+            "Starting %s: %s < %s",
+            self.__class__.__name__,
+            ' '.join(self.submit_command),
+            self.batch_file,
+        )
+        # feed the script on stdin, rather than via a shell redirect
+        with open(self.batch_file, 'rb') as script:
+            p = Popen(self.submit_command, stdin=script, stdout=PIPE)
+            output, err = p.communicate()
         output = output.decode(DEFAULT_ENCODING, 'replace')
         job_id = self.parse_job_id(output)
         self.notify_start(job_id)
@@ -1585,15 +2010,16 @@ class LSFControllerLauncher(LSFLauncher, BatchClusterAppMixin):
     batch_file_name = Unicode(
         u'lsf_controller', config=True, help="batch file name for the controller job."
     )
-    default_template = Unicode(
-        """#!/bin/sh
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = """#!/bin/sh
     #BSUB -J ipcontroller
     #BSUB -oo ipcontroller.o.%%J
     #BSUB -eo ipcontroller.e.%%J
     %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
     """
-        % (' '.join(map(pipes.quote, ipcontroller_cmd_argv)))
-    )
+        return template % _cmd_line(ipcontroller_cmd_argv)
 
     def start(self):
         """Start the controller by profile or profile_dir."""
@@ -1606,14 +2032,15 @@ class LSFEngineSetLauncher(LSFLauncher, BatchClusterAppMixin):
     batch_file_name = Unicode(
         u'lsf_engines', config=True, help="batch file name for the engine(s) job."
     )
-    default_template = Unicode(
-        u"""#!/bin/sh
+    default_template = Unicode()
+
+    def _default_template_default(self):
+        template = u"""#!/bin/sh
     #BSUB -oo ipengine.o.%%J
     #BSUB -eo ipengine.e.%%J
     %s --profile-dir="{profile_dir}" --cluster-id="{cluster_id}"
     """
-        % (' '.join(map(pipes.quote, ipengine_cmd_argv)))
-    )
+        return template % _cmd_line(ipengine_cmd_argv)
 
 
 class HTCondorLauncher(BatchSystemLauncher):
@@ -70,3 +70,104 @@ def forward_read_events(fd, context=None):
 
 
 __all__ = ['forward_read_events']
+
+
+# Win32 access rights and constants for kill_tree
+_PROCESS_TERMINATE = 0x0001
+_SYNCHRONIZE = 0x00100000
+_TH32CS_SNAPPROCESS = 0x00000002
+_MAX_PATH = 260
+
+
+def _child_map(kernel32):
+    """Return a dict of {parent_pid: [child_pids]} for all running processes"""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESSENTRY32W(ctypes.Structure):
+        _fields_ = [
+            ('dwSize', wintypes.DWORD),
+            ('cntUsage', wintypes.DWORD),
+            ('th32ProcessID', wintypes.DWORD),
+            ('th32DefaultHeapID', ctypes.c_void_p),
+            ('th32ModuleID', wintypes.DWORD),
+            ('cntThreads', wintypes.DWORD),
+            ('th32ParentProcessID', wintypes.DWORD),
+            ('pcPriClassBase', wintypes.LONG),
+            ('dwFlags', wintypes.DWORD),
+            ('szExeFile', wintypes.WCHAR * _MAX_PATH),
+        ]
+
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    kernel32.CreateToolhelp32Snapshot.argtypes = [wintypes.DWORD, wintypes.DWORD]
+    kernel32.Process32FirstW.argtypes = [
+        wintypes.HANDLE,
+        ctypes.POINTER(PROCESSENTRY32W),
+    ]
+    kernel32.Process32NextW.argtypes = kernel32.Process32FirstW.argtypes
+
+    snapshot = kernel32.CreateToolhelp32Snapshot(_TH32CS_SNAPPROCESS, 0)
+    if snapshot == wintypes.HANDLE(-1).value:
+        raise ctypes.WinError(ctypes.get_last_error())
+    children = {}
+    try:
+        entry = PROCESSENTRY32W()
+        entry.dwSize = ctypes.sizeof(entry)
+        more = kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+        while more:
+            children.setdefault(entry.th32ParentProcessID, []).append(
+                entry.th32ProcessID
+            )
+            more = kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(snapshot)
+    return children
+
+
+def kill_tree(pid, timeout=None):
+    """Terminate a process and all of its descendants.
+
+    Equivalent to `taskkill -pid PID -t -f`, without spawning taskkill.exe.
+    Waits up to `timeout` seconds (forever if None) for the processes to exit.
+
+    Raises OSError if `pid` itself cannot be terminated.
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = [wintypes.DWORD, wintypes.BOOL, wintypes.DWORD]
+    kernel32.TerminateProcess.argtypes = [wintypes.HANDLE, wintypes.UINT]
+    kernel32.WaitForSingleObject.argtypes = [wintypes.HANDLE, wintypes.DWORD]
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+
+    # collect the whole tree before killing anything,
+    # so that parent/child relationships are still intact
+    children = _child_map(kernel32)
+    pids = [pid]
+    for p in pids:
+        pids.extend(c for c in children.get(p, []) if c not in pids)
+
+    if timeout is None:
+        wait_ms = 0xFFFFFFFF  # INFINITE
+    else:
+        wait_ms = int(timeout * 1000)
+
+    handles = []
+    try:
+        for p in pids:
+            h = kernel32.OpenProcess(_PROCESS_TERMINATE | _SYNCHRONIZE, False, p)
+            if not h:
+                if p == pid:
+                    raise ctypes.WinError(ctypes.get_last_error())
+                # descendant already gone
+                continue
+            handles.append(h)
+            if not kernel32.TerminateProcess(h, 1) and p == pid:
+                raise ctypes.WinError(ctypes.get_last_error())
+        for h in handles:
+            kernel32.WaitForSingleObject(h, wait_ms)
+    finally:
+        for h in handles:
+            kernel32.CloseHandle(h)
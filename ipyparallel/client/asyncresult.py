@@ -703,8 +703,7 @@ class AsyncMapResult(AsyncResult):
     # asynchronous iterator:
     def __iter__(self):
         it = self._ordered_iter if self.ordered else self._unordered_iter
-        for r in it():
-            yield r
+        return it()
 
     def _yield_child_results(self, child):
         """Yield results from a child
@@ -38,6 +38,7 @@ from IPython.paths import get_ipython_dir
 from IPython.utils.path import compress_user
 from ipython_genutils.py3compat import cast_bytes, string_types, xrange, iteritems
 from traitlets import HasTraits, Instance, Unicode, Dict, List, Bool, Set, Any
+from traitlets import Integer
 from decorator import decorator
 
 from ipyparallel.serialize import Reference
@@ -338,6 +339,10 @@ class Client(HasTraits):
     _output_futures = Dict()
     _io_loop = Any()
     _io_thread = Any()
+    # sends waiting for the IO thread, and whether a flush is scheduled
+    _send_queue = List()
+    _send_flush_scheduled = Bool(False)
+    _send_lock = Any()
 
     profile = Unicode()
 
@@ -355,6 +360,8 @@ class Client(HasTraits):
 
     _outstanding_dict = Instance('collections.defaultdict', (set,))
     _ids = List()
+    # incremented whenever engines register or unregister
+    _targets_version = Integer(0)
     _connected = Bool(False)
     _ssh = Bool(False)
     _context = Instance('zmq.Context', allow_none=True)
@@ -395,6 +402,8 @@ class Client(HasTraits):
             super(Client, self).__init__(debug=debug, profile=profile)
         else:
             super(Client, self).__init__(debug=debug)
+        # created up front: a lazy default could build one lock per thread
+        self._send_lock = threading.Lock()
         if context is None:
             context = zmq.Context.instance()
         self._context = context
@@ -611,6 +620,7 @@ class Client(HasTraits):
                 self._ids.append(eid)
             self._engines[eid] = v
         self._ids = sorted(self._ids)
+        self._targets_version += 1
         if (
             sorted(self._engines.keys()) != list(range(len(self._engines)))
             and self._task_scheme == 'pure'
@@ -786,6 +796,7 @@ class Client(HasTraits):
         if eid in self._ids:
             self._ids.remove(eid)
             uuid = self._engines.pop(eid)
+            self._targets_version += 1
 
             self._handle_stranded_msgs(eid, uuid)
 
@@ -1131,9 +1142,40 @@ class Client(HasTraits):
                 futures[0].tracker.set_result(sent['tracker'])
 
         # hand off actual send to IO thread
-        self._io_loop.add_callback(_really_send)
+        self._queue_send(_really_send)
         return futures[0]
 
+    def _queue_send(self, send):
+        """Queue a send to be called in the IO thread.
+
+        Sends queued before the IO thread gets to them are flushed
+        in a single callback, instead of waking the IO thread once per message.
+        """
+        with self._send_lock:
+            self._send_queue.append(send)
+            if self._send_flush_scheduled:
+                return
+            self._send_flush_scheduled = True
+        self._io_loop.add_callback(self._flush_sends)
+
+    def _flush_sends(self):
+        """Call all queued sends, in order. Runs in the IO thread."""
+        with self._send_lock:
+            sends = self._send_queue
+            self._send_queue = []
+            self._send_flush_scheduled = False
+        error = None
+        for send in sends:
+            try:
+                send()
+            except Exception as e:
+                # one failed send shouldn't prevent the others
+                if error is None:
+                    error = e
+        if error is not None:
+            # let the IOLoop log it, as it would for a single send
+            raise error
+
     def _send_recv(self, *args, **kwargs):
         """Send a message in the IO thread and return its reply"""
         future = self._send(*args, **kwargs)
@@ -1146,7 +1188,8 @@ class Client(HasTraits):
 
     def __len__(self):
         """len(client) returns # of engines."""
-        return len(self.ids)
+        # no need for the copy made by self.ids
+        return len(self._ids)
 
     def __getitem__(self, key):
         """index access returns DirectView multiplexer objects
@@ -1556,14 +1599,11 @@ class Client(HasTraits):
 
         return result
 
-    def send_apply_request(
-        self, socket, f, args=None, kwargs=None, metadata=None, track=False, ident=None
-    ):
-        """construct and send an apply message via a socket.
+    def _pack_apply_request(self, f, args, kwargs, metadata):
+        """validate and serialize the arguments of an apply request
 
-        This is the principal method with which all engine execution is performed by views.
+        Returns the buffers to send, and the default-filled metadata.
         """
-
         if self._closed:
             raise RuntimeError(
                 "Client cannot be used after its sockets have been closed"
@@ -1591,17 +1631,10 @@ class Client(HasTraits):
             buffer_threshold=self.session.buffer_threshold,
             item_threshold=self.session.item_threshold,
         )
+        return bufs, metadata
 
-        future = self._send(
-            socket,
-            "apply_request",
-            buffers=bufs,
-            ident=ident,
-            metadata=metadata,
-            track=track,
-        )
-
-        msg_id = future.msg_id
+    def _save_sent(self, msg_id, ident):
+        """record a sent request in outstanding and history"""
         self.outstanding.add(msg_id)
         if ident:
             # possibly routed to a specific engine
@@ -1612,13 +1645,57 @@ class Client(HasTraits):
                 self._outstanding_dict[ident].add(msg_id)
         self.history.append(msg_id)
 
+    def send_apply_request(
+        self, socket, f, args=None, kwargs=None, metadata=None, track=False, ident=None
+    ):
+        """construct and send an apply message via a socket.
+
+        This is the principal method with which all engine execution is performed by views.
+        """
+        bufs, metadata = self._pack_apply_request(f, args, kwargs, metadata)
+
+        future = self._send(
+            socket,
+            "apply_request",
+            buffers=bufs,
+            ident=ident,
+            metadata=metadata,
+            track=track,
+        )
+        self._save_sent(future.msg_id, ident)
         return future
 
-    def send_execute_request(
-        self, socket, code, silent=True, metadata=None, ident=None
+    def send_apply_request_many(
+        self, socket, f, args=None, kwargs=None, idents=(), metadata=None, track=False
     ):
-        """construct and send an execute request via a socket."""
+        """construct and send the same apply message to several engines.
+
+        The request is validated and serialized once, and the resulting buffers
+        are shared by the messages sent to each of `idents`.
+
+        Returns a list of futures, one per ident.
+        """
+        bufs, metadata = self._pack_apply_request(f, args, kwargs, metadata)
+
+        futures = []
+        for ident in idents:
+            future = self._send(
+                socket,
+                "apply_request",
+                buffers=bufs,
+                ident=ident,
+                metadata=metadata,
+                track=track,
+            )
+            self._save_sent(future.msg_id, ident)
+            futures.append(future)
+        return futures
 
+    def _pack_execute_request(self, code, silent, metadata):
+        """validate and pack the content of an execute request
+
+        Returns the packed content, and the default-filled metadata.
+        """
         if self._closed:
             raise RuntimeError(
                 "Client cannot be used after its sockets have been closed"
@@ -1634,25 +1711,42 @@ class Client(HasTraits):
             raise TypeError("metadata must be dict, not %s" % type(metadata))
 
         content = dict(code=code, silent=bool(silent), user_expressions={})
+        # pack once, Session.send passes already packed content through
+        return self.session.pack(content), metadata
 
+    def _send_execute(self, socket, content, metadata, ident):
+        """send a packed execute request, and record it"""
         future = self._send(
             socket, "execute_request", content=content, ident=ident, metadata=metadata
         )
 
         msg_id = future.msg_id
-        self.outstanding.add(msg_id)
-        if ident:
-            # possibly routed to a specific engine
-            if isinstance(ident, list):
-                ident = ident[-1]
-            if ident in self._engines.values():
-                # save for later, in case of engine death
-                self._outstanding_dict[ident].add(msg_id)
-        self.history.append(msg_id)
+        self._save_sent(msg_id, ident)
         self.metadata[msg_id]['submitted'] = util.utcnow()
-
         return future
 
+    def send_execute_request(
+        self, socket, code, silent=True, metadata=None, ident=None
+    ):
+        """construct and send an execute request via a socket."""
+        content, metadata = self._pack_execute_request(code, silent, metadata)
+        return self._send_execute(socket, content, metadata, ident)
+
+    def send_execute_request_many(
+        self, socket, code, silent=True, metadata=None, idents=()
+    ):
+        """construct and send the same execute request to several engines.
+
+        The request content is validated and packed once,
+        and shared by the messages sent to each of `idents`.
+
+        Returns a list of futures, one per ident.
+        """
+        content, metadata = self._pack_execute_request(code, silent, metadata)
+        return [
+            self._send_execute(socket, content, metadata, ident) for ident in idents
+        ]
+
     # --------------------------------------------------------------------------
     # construct a View object
     # --------------------------------------------------------------------------
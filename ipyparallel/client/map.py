@@ -62,6 +62,34 @@ class Map(object):
 
         return result
 
+    def getPartitions(self, seq, q, n=None):
+        """Returns all q partitions of seq, as a list.
+
+        Equivalent to calling getPartition for each p in range(q),
+        but computes the bounds in a single pass.
+        """
+        n = len(seq) if n is None else n
+        if q <= 0:
+            raise ValueError("must have 0 < q, but have q=%s" % q)
+
+        remainder = n % q
+        basesize = n // q
+
+        bounds = []
+        low = 0
+        for p in range(q):
+            high = low + basesize + (1 if p < remainder else 0)
+            bounds.append((low, high))
+            low = high
+
+        try:
+            return [seq[low:high] for low, high in bounds]
+        except TypeError:
+            # some objects (iterators) can't be sliced,
+            # make a list once, rather than once per partition
+            seq = list(islice(seq, n))
+            return [seq[low:high] for low, high in bounds]
+
     def joinPartitions(self, listOfPartitions):
         return self.concatenate(listOfPartitions)
 
@@ -87,6 +115,12 @@ class RoundRobinMap(Map):
         n = len(seq) if n is None else n
         return seq[p:n:q]
 
+    def getPartitions(self, seq, q, n=None):
+        n = len(seq) if n is None else n
+        if q <= 0:
+            raise ValueError("must have 0 < q, but have q=%s" % q)
+        return [seq[p:n:q] for p in range(q)]
+
     def joinPartitions(self, listOfPartitions):
         testObject = listOfPartitions[0]
         # First see if we have a known array type
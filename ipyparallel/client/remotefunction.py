@@ -5,8 +5,7 @@ from __future__ import division
 
 import sys
 import warnings
-
-from decorator import decorator
+from functools import wraps
 
 from . import map as Map
 from ..serialize import PrePickled
@@ -76,22 +75,26 @@ def getname(f):
     return str(f)
 
 
-@decorator
-def sync_view_results(f, self, *args, **kwargs):
+def sync_view_results(f):
     """sync relevant results from self.client to our results attribute.
 
     This is a clone of view.sync_results, but for remote functions
     """
-    view = self.view
-    if view._in_sync_results:
-        return f(self, *args, **kwargs)
-    view._in_sync_results = True
-    try:
-        ret = f(self, *args, **kwargs)
-    finally:
-        view._in_sync_results = False
-        view._sync_results()
-    return ret
+
+    @wraps(f)
+    def sync_view_results_wrapper(self, *args, **kwargs):
+        view = self.view
+        if view._in_sync_results:
+            return f(self, *args, **kwargs)
+        view._in_sync_results = True
+        try:
+            ret = f(self, *args, **kwargs)
+        finally:
+            view._in_sync_results = False
+            view._sync_results()
+        return ret
+
+    return sync_view_results_wrapper
 
 
 # --------------------------------------------------------------------------
@@ -257,7 +260,7 @@ class ParallelFunction(RemoteFunction):
             targets = self.view.targets
             # 'all' is lazily evaluated at execution time, which is now:
             if targets == 'all':
-                targets = client._build_targets(targets)[1]
+                targets = self.view._build_targets(targets)[1]
             elif isinstance(targets, int):
                 # single-engine view, targets must be iterable
                 targets = [targets]
@@ -267,11 +270,13 @@ class ParallelFunction(RemoteFunction):
 
         pf = PrePickled(self.func)
 
+        # partition each sequence in one pass
+        partitions = [
+            self.mapObject.getPartitions(seq, nparts, maxlen) for seq in sequences
+        ]
+
         for index, t in enumerate(targets):
-            args = []
-            for seq in sequences:
-                part = self.mapObject.getPartition(seq, index, nparts, maxlen)
-                args.append(part)
+            args = [parts[index] for parts in partitions]
 
             if sum([len(arg) for arg in args]) == 0:
                 continue
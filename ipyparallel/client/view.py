@@ -4,16 +4,15 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
-import imp
+import builtins
 import threading
 import warnings
 from contextlib import contextmanager
+from functools import wraps
+from types import FunctionType
+from weakref import WeakKeyDictionary
 
-from decorator import decorator
 from IPython import get_ipython
-from ipython_genutils.py3compat import iteritems
-from ipython_genutils.py3compat import PY3
-from ipython_genutils.py3compat import string_types
 from traitlets import Any
 from traitlets import Bool
 from traitlets import CFloat
@@ -27,6 +26,8 @@ from traitlets import Set
 from . import map as Map
 from .. import serialize
 from ..serialize import PrePickled
+from ..serialize.canning import can_map
+from ..serialize.canning import CannedFunction
 from .asyncresult import AsyncMapResult
 from .asyncresult import AsyncResult
 from .remotefunction import getname
@@ -37,37 +38,90 @@ from ipyparallel import util
 from ipyparallel.controller.dependency import Dependency
 from ipyparallel.controller.dependency import dependent
 
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+
+# pickled functions, keyed by the function,
+# with the attributes the pickle was made from
+_prepickled_functions = WeakKeyDictionary()
+
+
+def _prepickle_function(f):
+    """PrePickled(f), reused while `f` is unchanged.
+
+    Only functions canned by reference to their code are reused:
+    not closures or functions with defaults, whose values are pickled
+    when they are canned, nor functions pickled by dill or cloudpickle.
+    """
+    if (
+        f.__closure__
+        or f.__defaults__
+        or f.__kwdefaults__
+        or can_map.get(FunctionType) is not CannedFunction
+    ):
+        return PrePickled(f)
+    key = (f.__code__, f.__name__, f.__module__)
+    cached = _prepickled_functions.get(f)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    pf = PrePickled(f)
+    _prepickled_functions[f] = (key, pf)
+    return pf
+
+
+def _prepickle(obj):
+    """Wrap `obj` in PrePickled, unless it already is.
+
+    Plain functions, such as those used by push and pull,
+    are only pickled once.
+    """
+    if isinstance(obj, PrePickled):
+        return obj
+    if type(obj) is FunctionType:
+        return _prepickle_function(obj)
+    return PrePickled(obj)
+
+
 # -----------------------------------------------------------------------------
 # Decorators
 # -----------------------------------------------------------------------------
 
 
-@decorator
-def save_ids(f, self, *args, **kwargs):
+def save_ids(f):
     """Keep our history and outstanding attributes up to date after a method call."""
-    n_previous = len(self.client.history)
-    try:
-        ret = f(self, *args, **kwargs)
-    finally:
-        nmsgs = len(self.client.history) - n_previous
-        msg_ids = self.client.history[-nmsgs:]
-        self.history.extend(msg_ids)
-        self.outstanding.update(msg_ids)
-    return ret
-
-
-@decorator
-def sync_results(f, self, *args, **kwargs):
+
+    @wraps(f)
+    def save_ids_wrapper(self, *args, **kwargs):
+        n_previous = len(self.client.history)
+        try:
+            ret = f(self, *args, **kwargs)
+        finally:
+            # slice from n_previous, since history[-0:] would be the whole history
+            msg_ids = self.client.history[n_previous:]
+            self.history.extend(msg_ids)
+            self.outstanding.update(msg_ids)
+        return ret
+
+    return save_ids_wrapper
+
+
+def sync_results(f):
     """sync relevant results from self.client to our results attribute."""
-    if self._in_sync_results:
-        return f(self, *args, **kwargs)
-    self._in_sync_results = True
-    try:
-        ret = f(self, *args, **kwargs)
-    finally:
-        self._in_sync_results = False
-        self._sync_results()
-    return ret
+
+    @wraps(f)
+    def sync_results_wrapper(self, *args, **kwargs):
+        if self._in_sync_results:
+            return f(self, *args, **kwargs)
+        self._in_sync_results = True
+        try:
+            ret = f(self, *args, **kwargs)
+        finally:
+            self._in_sync_results = False
+            self._sync_results()
+        return ret
+
+    return sync_results_wrapper
 
 
 # -----------------------------------------------------------------------------
@@ -116,10 +170,12 @@ class View(HasTraits):
     client = Instance('ipyparallel.Client', allow_none=True)
 
     _socket = Any()
-    _flag_names = List(['targets', 'block', 'track'])
+    _flag_names = ('targets', 'block', 'track')
     _in_sync_results = Bool(False)
     _targets = Any()
     _idents = Any()
+    _targets_cache = Any()
+    _str_idents_cache = Any()
 
     def __init__(self, client=None, socket=None, **flags):
         super(View, self).__init__(client=client, _socket=socket)
@@ -138,9 +194,10 @@ class View(HasTraits):
         return "<%s %s>" % (self.__class__.__name__, strtargets)
 
     def __len__(self):
-        if isinstance(self.targets, list):
-            return len(self.targets)
-        elif isinstance(self.targets, int):
+        targets = self.targets
+        if isinstance(targets, list):
+            return len(targets)
+        elif isinstance(targets, int):
             return 1
         else:
             return len(self.client)
@@ -161,7 +218,7 @@ class View(HasTraits):
             safely edit after arrays and buffers during non-copying
             sends.
         """
-        for name, value in iteritems(kwargs):
+        for name, value in kwargs.items():
             if name not in self._flag_names:
                 raise KeyError("Invalid name: %r" % name)
             else:
@@ -185,17 +242,63 @@ class View(HasTraits):
         False
 
         """
-        # preflight: save flags, and set temporaries
+        # preflight: save and set only the flags that change
         saved_flags = {}
-        for f in self._flag_names:
-            saved_flags[f] = getattr(self, f)
-        self.set_flags(**kwargs)
+        changed_flags = {}
+        for name, value in kwargs.items():
+            if name not in self._flag_names:
+                raise KeyError("Invalid name: %r" % name)
+            current = getattr(self, name)
+            if value is not current:
+                saved_flags[name] = current
+                changed_flags[name] = value
+        if changed_flags:
+            self.set_flags(**changed_flags)
         # yield to the with-statement block
         try:
             yield
         finally:
             # postflight: restore saved flags
-            self.set_flags(**saved_flags)
+            if saved_flags:
+                self.set_flags(**saved_flags)
+
+    def _build_targets(self, targets):
+        """client._build_targets, cached for repeated use of the same targets.
+
+        The cache is invalidated when engines register or unregister.
+        """
+        version = self.client._targets_version
+        cached = self._targets_cache
+        if (
+            cached is not None
+            and cached[0] == version
+            and type(cached[1]) is type(targets)
+            and cached[1] == targets
+        ):
+            idents, target_ids = cached[2]
+        else:
+            idents, target_ids = self.client._build_targets(targets)
+            if isinstance(targets, list):
+                # copy, in case the caller modifies the list later
+                targets = list(targets)
+            self._targets_cache = (version, targets, (idents, target_ids))
+        # return copies, so callers can't modify the cache
+        return list(idents), list(target_ids)
+
+    def _build_targets_str(self, targets):
+        """Like _build_targets, but with idents decoded to str, e.g. for metadata.
+
+        The decoded idents are cached along with the targets.
+        """
+        idents, target_ids = self._build_targets(targets)
+        cached = self._targets_cache
+        str_cached = self._str_idents_cache
+        if str_cached is None or str_cached[0] is not cached:
+            str_cached = self._str_idents_cache = (
+                cached,
+                [ident.decode("utf8") for ident in idents],
+            )
+        return list(str_cached[1]), target_ids
 
     # ----------------------------------------------------------------
     # apply
@@ -206,9 +309,8 @@ class View(HasTraits):
 
         after submitting any tasks.
         """
-        delta = self.outstanding.difference(self.client.outstanding)
-        completed = self.outstanding.intersection(delta)
-        self.outstanding = self.outstanding.difference(completed)
+        # drop our msg_ids that are no longer outstanding in the client
+        self.outstanding.intersection_update(self.client.outstanding)
 
     @sync_results
     @save_ids
@@ -270,7 +372,8 @@ class View(HasTraits):
         False : timeout reached, some msg_ids still outstanding
         """
         if jobs is None:
-            jobs = self.history
+            # completed jobs have nothing to wait for
+            jobs = list(self.outstanding)
         return self.client.wait(jobs, timeout)
 
     def abort(self, jobs=None, targets=None, block=None):
@@ -320,10 +423,11 @@ class View(HasTraits):
         if isinstance(indices_or_msg_ids, int):
             indices_or_msg_ids = self.history[indices_or_msg_ids]
         elif isinstance(indices_or_msg_ids, (list, tuple, set)):
-            indices_or_msg_ids = list(indices_or_msg_ids)
-            for i, index in enumerate(indices_or_msg_ids):
-                if isinstance(index, int):
-                    indices_or_msg_ids[i] = self.history[index]
+            history = self.history
+            indices_or_msg_ids = [
+                history[index] if isinstance(index, int) else index
+                for index in indices_or_msg_ids
+            ]
         return self.client.get_result(indices_or_msg_ids, block=block, owner=owner)
 
     # -------------------------------------------------------------------
@@ -427,71 +531,72 @@ class DirectView(View):
 
         Note that remote-only (`local=False`) imports have not been implemented.
 
+        The remote imports are sent together, in one request, when the block exits.
+
         >>> with view.sync_imports():
         ...    from numpy import recarray
         importing recarray from numpy on engine(s)
 
         """
-        from ipython_genutils.py3compat import builtin_mod
-
-        local_import = builtin_mod.__import__
+        local_import = builtins.__import__
         modules = set()
-        results = []
+        imports = []
+        # only imports made directly in the with-block are also done remotely
+        import_thread = threading.get_ident()
+        import_depth = 0
 
         @util.interactive
-        def remote_import(name, fromlist, level):
-            """the function to be passed to apply, that actually performs the import
+        def remote_import(imports):
+            """the function to be passed to apply, that actually performs the imports
             on the engine, and loads up the user namespace.
             """
             import sys
 
             user_ns = globals()
-            mod = __import__(name, fromlist=fromlist, level=level)
-            if fromlist:
-                for key in fromlist:
-                    user_ns[key] = getattr(mod, key)
-            else:
-                user_ns[name] = sys.modules[name]
+            for name, fromlist, level in imports:
+                mod = __import__(name, fromlist=fromlist, level=level)
+                if fromlist:
+                    for key in fromlist:
+                        user_ns[key] = getattr(mod, key)
+                else:
+                    user_ns[name] = sys.modules[name]
 
         def view_import(name, globals={}, locals={}, fromlist=[], level=0):
             """the drop-in replacement for __import__, that optionally imports
             locally as well.
             """
-            # don't override nested imports
-            save_import = builtin_mod.__import__
-            builtin_mod.__import__ = local_import
-
-            if imp.lock_held():
-                # this is a side-effect import, don't do it remotely, or even
-                # ignore the local effects
+            nonlocal import_depth
+            if import_depth or threading.get_ident() != import_thread:
+                # this is a side-effect import, or one from another thread,
+                # don't do it remotely
                 return local_import(name, globals, locals, fromlist, level)
 
-            imp.acquire_lock()
-            if local:
-                mod = local_import(name, globals, locals, fromlist, level)
-            else:
-                raise NotImplementedError("remote-only imports not yet implemented")
-            imp.release_lock()
-
-            key = name + ':' + ','.join(fromlist or [])
-            if level <= 0 and key not in modules:
-                modules.add(key)
-                if not quiet:
-                    if fromlist:
-                        print(
-                            "importing %s from %s on engine(s)"
-                            % (','.join(fromlist), name)
-                        )
-                    else:
-                        print("importing %s on engine(s)" % name)
-                results.append(self.apply_async(remote_import, name, fromlist, level))
-            # restore override
-            builtin_mod.__import__ = save_import
+            import_depth += 1
+            try:
+                if local:
+                    mod = local_import(name, globals, locals, fromlist, level)
+                else:
+                    raise NotImplementedError("remote-only imports not yet implemented")
+
+                key = name + ':' + ','.join(fromlist or [])
+                if level <= 0 and key not in modules:
+                    modules.add(key)
+                    if not quiet:
+                        if fromlist:
+                            print(
+                                "importing %s from %s on engine(s)"
+                                % (','.join(fromlist), name)
+                            )
+                        else:
+                            print("importing %s on engine(s)" % name)
+                    imports.append((name, fromlist, level))
+            finally:
+                import_depth -= 1
 
             return mod
 
         # override __import__
-        builtin_mod.__import__ = view_import
+        builtins.__import__ = view_import
         try:
             # enter the block
             yield
@@ -503,9 +608,12 @@ class DirectView(View):
                 pass
         finally:
             # always restore __import__
-            builtin_mod.__import__ = local_import
+            builtins.__import__ = local_import
+            # send all the imports at once
+            if imports:
+                r = self.apply_async(remote_import, imports)
 
-        for r in results:
+        if imports:
             # raise possible remote ImportErrors here
             r.get()
 
@@ -576,18 +684,15 @@ class DirectView(View):
         track = self.track if track is None else track
         targets = self.targets if targets is None else targets
 
-        _idents, _targets = self.client._build_targets(targets)
-        futures = []
+        _idents, _targets = self._build_targets(targets)
 
-        pf = PrePickled(f)
-        pargs = [PrePickled(arg) for arg in args]
-        pkwargs = {k: PrePickled(v) for k, v in kwargs.items()}
+        # args are serialized once per call by the client,
+        # so only the function benefits from being pickled in advance
+        pf = _prepickle(f)
 
-        for ident in _idents:
-            future = self.client.send_apply_request(
-                self._socket, pf, pargs, pkwargs, track=track, ident=ident
-            )
-            futures.append(future)
+        futures = self.client.send_apply_request_many(
+            self._socket, pf, args, kwargs, idents=_idents, track=track
+        )
         if track:
             trackers = [_.tracker for _ in futures]
         else:
@@ -666,13 +771,10 @@ class DirectView(View):
         block = self.block if block is None else block
         targets = self.targets if targets is None else targets
 
-        _idents, _targets = self.client._build_targets(targets)
-        futures = []
-        for ident in _idents:
-            future = self.client.send_execute_request(
-                self._socket, code, silent=silent, ident=ident
-            )
-            futures.append(future)
+        _idents, _targets = self._build_targets(targets)
+        futures = self.client.send_execute_request_many(
+            self._socket, code, silent=silent, idents=_idents
+        )
         if isinstance(targets, int):
             futures = futures[0]
         ar = AsyncResult(
@@ -756,16 +858,18 @@ class DirectView(View):
         """
         block = block if block is not None else self.block
         targets = targets if targets is not None else self.targets
-        if isinstance(names, string_types):
+        if isinstance(names, str):
             pass
         elif isinstance(names, (list, tuple, set)):
             for key in names:
-                if not isinstance(key, string_types):
+                if not isinstance(key, str):
                     raise TypeError("keys must be str, not type %r" % type(key))
         else:
             raise TypeError("names must be strs, not %r" % names)
         return self._really_apply(util._pull, (names,), block=block, targets=targets)
 
+    @sync_results
+    @save_ids
     def scatter(
         self, key, seq, dist='b', flatten=False, targets=None, block=None, track=None
     ):
@@ -776,22 +880,23 @@ class DirectView(View):
         track = track if track is not None else self.track
         targets = targets if targets is not None else self.targets
 
-        # construct integer ID list:
-        targets = self.client._build_targets(targets)[1]
+        _idents, targets = self._build_targets(targets)
 
         mapObject = Map.dists[dist]()
         nparts = len(targets)
         futures = []
-        trackers = []
-        for index, engineid in enumerate(targets):
-            partition = mapObject.getPartition(seq, index, nparts)
+        pf = _prepickle(util._push)
+        partitions = mapObject.getPartitions(seq, nparts)
+        for ident, partition in zip(_idents, partitions):
             if flatten and len(partition) == 1:
-                ns = {key: partition[0]}
+                ns = {key: PrePickled(partition[0])}
             else:
-                ns = {key: partition}
-            r = self.push(ns, block=False, track=track, targets=engineid)
-            r.owner = False
-            futures.extend(r._children)
+                ns = {key: PrePickled(partition)}
+            # send each partition directly, rather than via a push per engine
+            future = self.client.send_apply_request(
+                self._socket, pf, kwargs=ns, track=track, ident=ident
+            )
+            futures.append(future)
 
         r = AsyncResult(
             self.client, futures, fname='scatter', targets=targets, owner=True
@@ -810,16 +915,13 @@ class DirectView(View):
         block = block if block is not None else self.block
         targets = targets if targets is not None else self.targets
         mapObject = Map.dists[dist]()
-        msg_ids = []
 
-        # construct integer ID list:
-        targets = self.client._build_targets(targets)[1]
+        _idents, targets = self._build_targets(targets)
 
-        futures = []
-        for index, engineid in enumerate(targets):
-            ar = self.pull(key, block=False, targets=engineid)
-            ar.owner = False
-            futures.extend(ar._children)
+        # the same pull request goes to every engine, so serialize it once
+        futures = self.client.send_apply_request_many(
+            self._socket, _prepickle(util._pull), [key], idents=_idents
+        )
 
         r = AsyncMapResult(self.client, futures, mapObject, fname='gather')
 
@@ -890,40 +992,46 @@ class BroadcastView(DirectView):
         block = self.block if block is None else block
         track = self.track if track is None else track
         targets = self.targets if targets is None else targets
-        idents, _targets = self.client._build_targets(targets)
-        futures = []
-
-        pf = PrePickled(f)
-        pargs = [PrePickled(arg) for arg in args]
-        pkwargs = {k: PrePickled(v) for k, v in kwargs.items()}
+        s_idents, _targets = self._build_targets_str(targets)
 
-        s_idents = [ident.decode("utf8") for ident in idents]
+        # args are serialized once per call by the client,
+        # so only the function benefits from being pickled in advance
+        pf = _prepickle(f)
 
         metadata = dict(
             targets=s_idents, is_broadcast=True, is_coalescing=self.is_coalescing
         )
         if not self.is_coalescing:
             original_future = self.client.send_apply_request(
-                self._socket, pf, pargs, pkwargs, track=track, metadata=metadata
+                self._socket, pf, args, kwargs, track=track, metadata=metadata
             )
             original_msg_id = original_future.msg_id
 
-            for ident in s_idents:
-                msg_and_target_id = f'{original_msg_id}_{ident}'
-                future = self.client.create_message_futures(
-                    msg_and_target_id, async_result=True, track=True
-                )
-                self.client.outstanding.add(msg_and_target_id)
-                self.outstanding.add(msg_and_target_id)
-                futures.append(future[0])
-            if original_msg_id in self.outstanding:
-                self.outstanding.remove(original_msg_id)
+            client = self.client
+            prefix = original_msg_id + '_'
+            msg_and_target_ids = [prefix + ident for ident in s_idents]
+            create_message_futures = client.create_message_futures
+            futures = [
+                create_message_futures(msg_id, async_result=True)[0]
+                for msg_id in msg_and_target_ids
+            ]
+            # the sub-requests go out in the original's single send
+            for future in futures:
+                future.tracker = original_future.tracker
+            # only the per-target requests get replies, so the client tracks
+            # those in place of the original request. save_ids picks them up
+            # from the history, and sync_results drops the original from
+            # our outstanding set.
+            client.outstanding.discard(original_msg_id)
+            client._futures.pop(original_msg_id, None)
+            client._output_futures.pop(original_msg_id, None)
+            client.metadata.pop(original_msg_id, None)
+            client.outstanding.update(msg_and_target_ids)
+            client.history.extend(msg_and_target_ids)
         else:
-            message_future = self.client.send_apply_request(
-                self._socket, pf, pargs, pkwargs, track=track, metadata=metadata
+            futures = self.client.send_apply_request(
+                self._socket, pf, args, kwargs, track=track, metadata=metadata
             )
-            self.client.outstanding.add(message_future.msg_id)
-            futures = message_future
 
         ar = AsyncResult(
             self.client, futures, fname=getname(f), targets=_targets, owner=True
@@ -960,9 +1068,7 @@ class LoadBalancedView(View):
     retries = Integer(0)
 
     _task_scheme = Any()
-    _flag_names = List(
-        ['targets', 'block', 'track', 'follow', 'after', 'timeout', 'retries']
-    )
+    _flag_names = ('targets', 'block', 'track', 'follow', 'after', 'timeout', 'retries')
 
     def __init__(self, client=None, socket=None, **flags):
         super(LoadBalancedView, self).__init__(client=client, socket=socket, **flags)
@@ -973,11 +1079,11 @@ class LoadBalancedView(View):
 
         For use in `set_flags`.
         """
-        if dep is None or isinstance(dep, string_types + (AsyncResult, Dependency)):
+        if dep is None or isinstance(dep, (str, AsyncResult, Dependency)):
             return True
         elif isinstance(dep, (list, set, tuple)):
             for d in dep:
-                if not isinstance(d, string_types + (AsyncResult,)):
+                if not isinstance(d, (str, AsyncResult)):
                     return False
         elif isinstance(dep, dict):
             if set(dep.keys()) != set(Dependency().as_dict().keys()):
@@ -985,7 +1091,7 @@ class LoadBalancedView(View):
             if not isinstance(dep['msg_ids'], list):
                 return False
             for d in dep['msg_ids']:
-                if not isinstance(d, string_types):
+                if not isinstance(d, str):
                     return False
         else:
             return False
@@ -994,16 +1100,35 @@ class LoadBalancedView(View):
 
     def _render_dependency(self, dep):
         """helper for building jsonable dependencies from various input forms."""
-        if isinstance(dep, Dependency):
+        # no dependency is the common case, check it first
+        if dep is None:
+            return []
+        elif isinstance(dep, Dependency):
             return dep.as_dict()
         elif isinstance(dep, AsyncResult):
             return dep.msg_ids
-        elif dep is None:
-            return []
         else:
             # pass to Dependency constructor
             return list(Dependency(dep))
 
+    def _dependency_met(self, dep):
+        """Whether `dep` is AsyncResults that have all completed successfully.
+
+        That meets a default dependency (all, success only).
+        Anything else, such as msg_ids or a Dependency with other flags,
+        is left for the scheduler to judge.
+        """
+        if isinstance(dep, AsyncResult):
+            dep = [dep]
+        elif not isinstance(dep, (list, tuple)) or not dep:
+            return False
+        for ar in dep:
+            if not isinstance(ar, AsyncResult) or not ar.ready():
+                return False
+            if not ar.successful():
+                return False
+        return True
+
     def set_flags(self, **kwargs):
         """set my attribute flags by keyword.
 
@@ -1143,10 +1268,12 @@ class LoadBalancedView(View):
         if targets is None:
             idents = []
         else:
-            idents = self.client._build_targets(targets)[0]
             # ensure *not* bytes
-            idents = [ident.decode() for ident in idents]
+            idents = self._build_targets_str(targets)[0]
 
+        if after is not None and self._dependency_met(after):
+            # nothing left to wait for, so the scheduler can skip the check
+            after = None
         after = self._render_dependency(after)
         follow = self._render_dependency(follow)
         metadata = dict(
@@ -1218,19 +1345,17 @@ class LoadBalancedView(View):
         """
 
         # default
-        block = kwargs.get('block', self.block)
-        chunksize = kwargs.get('chunksize', 1)
-        ordered = kwargs.get('ordered', True)
-
-        keyset = set(kwargs.keys())
-        extra_keys = keyset.difference_update(set(['block', 'chunksize']))
-        if extra_keys:
-            raise TypeError("Invalid kwargs: %s" % list(extra_keys))
+        block = kwargs.pop('block', self.block)
+        chunksize = kwargs.pop('chunksize', 1)
+        ordered = kwargs.pop('ordered', True)
+        for k in kwargs:
+            if k != 'track':
+                raise TypeError("invalid keyword arg, %r" % k)
 
         assert len(sequences) > 0, "must have some sequences to map onto!"
 
         pf = ParallelFunction(
-            self, f, block=block, chunksize=chunksize, ordered=ordered
+            self, f, block=block, chunksize=chunksize, ordered=ordered, **kwargs
         )
         return pf.map(*sequences)
 
@@ -1277,12 +1402,11 @@ class ViewExecutor(Executor):
         return self.view.apply_async(fn, *args, **kwargs)
 
     def map(self, func, *iterables, **kwargs):
-        """Return generator for View.map_async"""
+        """Return an iterator over View.map_async"""
         if 'timeout' in kwargs:
             warnings.warn("timeout unsupported in ViewExecutor.map")
             kwargs.pop('timeout')
-        for r in self.view.map_async(func, *iterables, **kwargs):
-            yield r
+        return iter(self.view.map_async(func, *iterables, **kwargs))
 
     def shutdown(self, wait=True):
         """ViewExecutor does *not* shutdown engines
@@ -331,7 +331,13 @@ class HubFactory(RegistrationFactory):
         self.monitor_transport = new
         self._update_monitor_url()
 
+    @observe('client_ip', 'client_transport', 'engine_ip', 'engine_transport')
+    def _clear_url_cache(self, change=None):
+        self._url_cache = {}
+
     def __init__(self, **kwargs):
+        # cache of urls computed by client_url/engine_url
+        self._url_cache = {}
         super(HubFactory, self).__init__(**kwargs)
         self._update_monitor_url()
 
@@ -344,23 +350,31 @@ class HubFactory(RegistrationFactory):
 
     def client_url(self, channel, index=None):
         """return full zmq url for a named client channel"""
-        return "%s://%s:%i" % (
-            self.client_transport,
-            self.client_ip,
-            self.client_info[channel]
-            if index is None
-            else self.client_info[channel][index],
-        )
+        key = ('client', channel, index)
+        url = self._url_cache.get(key)
+        if url is None:
+            url = self._url_cache[key] = "%s://%s:%i" % (
+                self.client_transport,
+                self.client_ip,
+                self.client_info[channel]
+                if index is None
+                else self.client_info[channel][index],
+            )
+        return url
 
     def engine_url(self, channel, index=None):
         """return full zmq url for a named engine channel"""
-        return "%s://%s:%i" % (
-            self.engine_transport,
-            self.engine_ip,
-            self.engine_info[channel]
-            if index is None
-            else self.engine_info[channel][index],
-        )
+        key = ('engine', channel, index)
+        url = self._url_cache.get(key)
+        if url is None:
+            url = self._url_cache[key] = "%s://%s:%i" % (
+                self.engine_transport,
+                self.engine_ip,
+                self.engine_info[channel]
+                if index is None
+                else self.engine_info[channel][index],
+            )
+        return url
 
     def init_hub(self):
         """construct Hub object"""
@@ -403,6 +417,9 @@ class HubFactory(RegistrationFactory):
             ],
         }
 
+        # ports may have changed
+        self._clear_url_cache()
+
         self.log.debug("Hub engine addrs: %s", self.engine_info)
         self.log.debug("Hub client addrs: %s", self.client_info)
 
@@ -1393,8 +1410,7 @@ class Hub(SessionFactory):
 
         self.log.info("loading engine state from %s" % self.engine_state_file)
 
-        with open(self.engine_state_file) as f:
-            state = json.load(f)
+        state = util.json_load_file(self.engine_state_file)
 
         save_notifier = self.notifier
         self.notifier = None
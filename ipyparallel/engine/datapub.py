@@ -1,27 +1,57 @@
 """Publishing native (typically pickled) objects."""
 # Copyright (c) IPython Development Team.
 # Distributed under the terms of the Modified BSD License.
+import sys
+import time
+
 from ipykernel.jsonutil import json_clean
 from jupyter_client.session import extract_header
 from jupyter_client.session import Session
 from traitlets import Any
 from traitlets import CBytes
 from traitlets import Dict
+from traitlets import Float
 from traitlets import Instance
 from traitlets.config import Configurable
 
 from ipyparallel.serialize import serialize_object
 
 
+def _all_arrays(data):
+    """Whether every value in a dict is a numpy array"""
+    # numpy can't be in the namespace if it hasn't been imported
+    np = sys.modules.get('numpy')
+    return np is not None and all(isinstance(v, np.ndarray) for v in data.values())
+
+
 class ZMQDataPublisher(Configurable):
 
     topic = topic = CBytes(b'datapub')
     session = Instance(Session, allow_none=True)
     pub_socket = Any(allow_none=True)
     parent_header = Dict({})
+    flush_interval = Float(
+        0,
+        config=True,
+        help="""Minimum time (in seconds) between data messages.
+
+        Data published more often than this is merged, later values replacing
+        earlier ones as they would on the client, and sent at most once
+        per interval. Anything still pending is sent when the request finishes.
+        The default (0) sends every call immediately.
+        """,
+    )
+    # data merged while waiting for flush_interval
+    _pending = Dict()
+    _last_send = Float(0)
+    # cleaned message content, by the tuple of published keys
+    _keys_content = Dict()
+    _keys_content_size = 32
 
     def set_parent(self, parent):
         """Set the parent for outbound messages."""
+        # pending data belongs to the previous parent
+        self.flush()
         self.parent_header = extract_header(parent)
 
     def publish_data(self, data):
@@ -33,13 +63,41 @@ class ZMQDataPublisher(Configurable):
         data : dict
             The data to be published. Think of it as a namespace.
         """
+        if self.flush_interval:
+            self._pending.update(data)
+            if time.monotonic() - self._last_send < self.flush_interval:
+                return
+            data = self._pending
+            self._pending = {}
+        self._send_data(data)
+
+    def flush(self):
+        """Send any data held back by flush_interval"""
+        if self._pending:
+            data = self._pending
+            self._pending = {}
+            self._send_data(data)
+
+    def _send_data(self, data):
         session = self.session
+        item_threshold = session.item_threshold
+        if len(data) >= item_threshold and _all_arrays(data):
+            # can each array, so their data is sent as separate buffers
+            # instead of being pickled with the whole namespace
+            item_threshold = len(data) + 1
         buffers = serialize_object(
             data,
             buffer_threshold=session.buffer_threshold,
-            item_threshold=session.item_threshold,
+            item_threshold=item_threshold,
         )
-        content = json_clean(dict(keys=list(data.keys())))
+        keys = tuple(data)
+        keys_content = self._keys_content
+        content = keys_content.get(keys)
+        if content is None:
+            # the same keys are usually published over and over
+            if len(keys_content) >= self._keys_content_size:
+                keys_content.clear()
+            content = keys_content[keys] = json_clean(dict(keys=list(keys)))
         session.send(
             self.pub_socket,
             'data_message',
@@ -48,6 +106,7 @@ class ZMQDataPublisher(Configurable):
             buffers=buffers,
             ident=self.topic,
         )
+        self._last_send = time.monotonic()
 
 
 def publish_data(data):
@@ -234,7 +234,7 @@ class EngineFactory(RegistrationFactory):
     def _report_ping(self, msg):
         """Callback for when the heartmonitor.Heart receives a ping"""
         # self.log.debug("Received a ping: %s", msg)
-        self._hb_last_pinged = time.time()
+        self._hb_last_pinged = time.monotonic()
 
     def complete_registration(self, msg, connect, maybe_tunnel):
         # print msg
@@ -426,7 +426,7 @@ class EngineFactory(RegistrationFactory):
             )
             self.loop.stop()
 
-        self._hb_last_monitored = time.time()
+        self._hb_last_monitored = time.monotonic()
 
     def start(self):
         loop = self.loop
@@ -77,6 +77,11 @@ class IPythonParallelKernel(IPythonKernel):
 
         Run after completing a request handler.
         """
+        # send held-back data before the reply.
+        # data_pub_class is configurable, and custom publishers may not buffer
+        flush = getattr(self.shell.data_pub, 'flush', None)
+        if flush is not None:
+            flush()
         metadata['status'] = reply_content['status']
         if reply_content['status'] == 'error':
             if reply_content['ename'] == 'UnmetDependency':
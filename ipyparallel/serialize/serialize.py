@@ -157,10 +157,14 @@ def deserialize_object(buffers, g=None):
         for c in canned:
             _restore_buffers(c, bufs)
         newobj = uncan_sequence(canned, g)
-    elif istype(canned, dict) and len(canned) < MAX_ITEMS:
+    elif istype(canned, dict):
+        # no item limit here: the sender may have canned the values of
+        # a large dict, and uncanning the values of a dict pickled whole
+        # is what uncan would do anyway.
+        # The sender cans values in key order, so the pickled dict's order
+        # matches the order of the buffers, and keys need not be sortable.
         newobj = {}
-        for k in sorted(canned):
-            c = canned[k]
+        for k, c in canned.items():
             _restore_buffers(c, bufs)
             newobj[k] = uncan(c, g)
     else:
@@ -11,6 +11,7 @@ from zmq.eventloop import zmqstream
 
 import ipyparallel
 from ipyparallel.apps import ipengineapp
+from ipyparallel.engine.engine import EngineFactory
 from ipyparallel.util import ioloop
 
 try:
@@ -35,14 +36,15 @@ def test_version():
 
 
 def bind_kernel(engineapp):
-    app = MagicMock(spec=kernelapp.IPKernelApp)
-    with patch.object(ipengineapp, 'IPKernelApp', autospec=True) as MockKernelApp:
+    IPKernelApp = kernelapp.IPKernelApp
+    app = MagicMock(spec=IPKernelApp)
+    with patch.object(kernelapp, 'IPKernelApp', autospec=True) as MockKernelApp:
         MockKernelApp.return_value = app
         app.shell_port = app.iopub_port = app.stdin_port = 0
-        app._bind_socket = types.MethodType(kernelapp.IPKernelApp._bind_socket, app)
-        if hasattr(kernelapp.IPKernelApp, '_try_bind_socket'):
+        app._bind_socket = types.MethodType(IPKernelApp._bind_socket, app)
+        if hasattr(IPKernelApp, '_try_bind_socket'):
             app._try_bind_socket = types.MethodType(
-                kernelapp.IPKernelApp._try_bind_socket,
+                IPKernelApp._try_bind_socket,
                 app,
             )
         app.transport = 'tcp'
@@ -54,7 +56,7 @@ def bind_kernel(engineapp):
 def test_bind_kernel():
     class MockIPEngineApp(ipengineapp.IPEngineApp):
         kernel = None
-        engine = MagicMock(spec=ipengineapp.EngineFactory)
+        engine = MagicMock(spec=EngineFactory)
 
     app = MockIPEngineApp()
     app.kernel_app = None
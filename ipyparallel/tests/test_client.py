@@ -21,7 +21,7 @@ import tornado
 
 from IPython import get_ipython
 from ipyparallel.client import client as clientmod
-from ipyparallel import error, AsyncHubResult, DirectView, Reference
+from ipyparallel import error, AsyncHubResult, AsyncResult, DirectView, Reference
 from ipyparallel.util import utc
 
 from .clienttest import ClusterTestCase, wait, add_engines, skip_without
@@ -88,6 +88,20 @@ class TestClient(ClusterTestCase):
         v = self.client.direct_view(-1)
         self.assertEqual(v.targets, self.client.ids[-1])
 
+    def test_view_targets_cache(self):
+        """a view's cached targets are rebuilt when engines register"""
+        v = self.client.direct_view()
+        idents, targets = v._build_targets(v.targets)
+        self.assertEqual(targets, self.client.ids)
+        self.assertEqual(v._build_targets(v.targets), (idents, targets))
+        self.assertEqual(
+            v._build_targets_str(v.targets),
+            ([ident.decode() for ident in idents], targets),
+        )
+        self.add_engines(1)
+        self.assertEqual(v._build_targets(v.targets)[1], self.client.ids)
+        self.assertEqual(len(self.client.ids), len(targets) + 1)
+
     def test_lazy_all_targets(self):
         """test lazy evaluation of rc.direct_view('all')"""
         v = self.client.direct_view()
@@ -165,6 +179,20 @@ class TestClient(ClusterTestCase):
         self.assertEqual(ar3.msg_ids, ar2.msg_ids)
         c.close()
 
+    def test_send_apply_request_many(self):
+        """one apply request, sent to several engines"""
+        idents, targets = self.client._build_targets(self.client.ids[:2])
+        futures = self.client.send_apply_request_many(
+            self.client._mux_socket, wait, (0,), idents=idents
+        )
+        self.assertEqual(len(futures), 2)
+        msg_ids = [f.msg_id for f in futures]
+        self.assertEqual(len(set(msg_ids)), 2)
+        self.assertEqual(self.client.history[-2:], msg_ids)
+        ar = AsyncResult(self.client, futures, targets=targets)
+        self.assertEqual(ar.get(), [0, 0])
+        self.assertEqual(ar.engine_id, targets)
+
     def test_get_execute_result(self):
         """test getting execute results from the Hub."""
         c = clientmod.Client(profile='iptest')
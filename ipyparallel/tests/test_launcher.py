@@ -8,6 +8,7 @@ import os
 import shutil
 import sys
 import tempfile
+from types import SimpleNamespace
 from unittest import TestCase
 
 import pytest
@@ -93,6 +94,14 @@ class SSHTest:
         launcher = self.build_launcher()
         self.assertEqual(launcher.remote_profile_dir, self.profile_dir)
 
+    def test_ssh_multiplex(self):
+        el = self.build_launcher()
+        self.assertFalse(any('ControlMaster' in arg for arg in el.args))
+        if launcher.WINDOWS:
+            pytest.skip("ssh connection sharing is not supported on Windows")
+        el = self.build_launcher(ssh_multiplex=True)
+        self.assertTrue(any('ControlMaster' in arg for arg in el.args))
+
 
 # -------------------------------------------------------------------------------
 # Controller Launcher Tests
@@ -151,6 +160,34 @@ class EngineSetLauncherTest(LauncherTest):
 class TestLocalEngineSetLauncher(EngineSetLauncherTest, TestCase):
     launcher_class = launcher.LocalEngineSetLauncher
 
+    def test_notify_stop_after_last_engine(self):
+        engine_set = self.build_launcher()
+        engine_set.state = 'running'
+        stopped = []
+        engine_set.on_stop(stopped.append)
+        for i in range(3):
+            el = SimpleNamespace(process=SimpleNamespace(pid=100 + i))
+            engine_set._add_launcher(i, el)
+        # engines may stop in any order
+        for pid in (101, 100):
+            engine_set._notice_engine_stopped(dict(pid=pid, exit_code=0))
+            self.assertEqual(stopped, [])
+        # a start that hasn't happened yet keeps the set running
+        engine_set._pending_starts = {3: None}
+        engine_set._notice_engine_stopped(dict(pid=102, exit_code=0))
+        self.assertEqual(stopped, [])
+        engine_set._pending_starts = {}
+        engine_set._add_launcher(3, SimpleNamespace(process=SimpleNamespace(pid=103)))
+        engine_set._notice_engine_stopped(dict(pid=103, exit_code=1))
+        self.assertEqual(len(stopped), 1)
+        self.assertEqual(sorted(stopped[0]), [0, 1, 2, 3])
+        self.assertEqual(stopped[0][3], dict(pid=103, exit_code=1))
+        self.assertEqual(engine_set.state, 'after')
+        # a repeated or unknown stop notification is ignored
+        engine_set._notice_engine_stopped(dict(pid=103, exit_code=1))
+        engine_set._notice_engine_stopped(dict(pid=999, exit_code=0))
+        self.assertEqual(len(stopped), 1)
+
 
 class TestMPIEngineSetLauncher(EngineSetLauncherTest, TestCase):
     launcher_class = launcher.MPIEngineSetLauncher
@@ -40,6 +40,12 @@ class TestLoadBalancedView(ClusterTestCase):
         r = self.view.map_sync(f, data)
         self.assertEqual(r, list(map(f, data)))
 
+    def test_map_invalid_kwargs(self):
+        with self.assertRaises(TypeError):
+            self.view.map(lambda x: x, range(4), bogus=True)
+        r = self.view.map(lambda x: x, range(4), block=True, track=True)
+        self.assertEqual(r, list(range(4)))
+
     def test_map_generator(self):
         def f(x):
             return x ** 2
@@ -193,6 +199,19 @@ class TestLoadBalancedView(ClusterTestCase):
                 error.ImpossibleDependency, view.apply_sync, lambda: 1
             )
 
+    def test_after_completed(self):
+        view = self.view
+        ar = view.apply_async(lambda: 1)
+        ar.get()
+        self.assertTrue(view._dependency_met(ar))
+        self.assertTrue(view._dependency_met([ar]))
+        self.assertFalse(view._dependency_met(['12345']))
+        failed = view.apply_async(lambda: 1 / 0)
+        failed.wait()
+        self.assertFalse(view._dependency_met([ar, failed]))
+        with view.temp_flags(after=ar):
+            self.assertEqual(view.apply_sync(lambda: 2), 2)
+
     def test_follow(self):
         ar = self.view.apply_async(lambda: 1)
         ar.get()
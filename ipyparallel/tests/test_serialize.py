@@ -149,6 +149,30 @@ def test_numpy_in_dict():
             assert_array_equal(A, B)
 
 
+def test_numpy_in_large_dict():
+    numpy = pytest.importorskip('numpy')
+    from numpy.testing import assert_array_equal
+
+    d = {'a%i' % i: numpy.arange(i, i + 1024) for i in range(100)}
+    # values are canned even past the default item threshold
+    bufs = serialize_object(d, item_threshold=len(d) + 1)
+    assert len(bufs) == len(d) + 1
+    d2, r = deserialize_object(bufs)
+    assert r == []
+    assert sorted(d2) == sorted(d)
+    for key, A in d.items():
+        assert_array_equal(A, d2[key])
+
+
+def test_large_dict_mixed_keys():
+    # pickled whole, past the item threshold, with keys that can't be sorted
+    d = {i: i for i in range(100)}
+    d['a'] = 'b'
+    d2 = roundtrip(d)
+    assert d2 == d
+    assert list(d2) == list(d)
+
+
 def test_class():
     @interactive
     class C(object):
@@ -22,3 +22,27 @@ def test_disambiguate_ip(warn_mock):
         RuntimeWarning,
     )
     assert util.disambiguate_ip_address('0.0.0.0', public_ip) == localhost()
+
+
+def test_json_roundtrip():
+    d = {'key': 'abc', 'registration': 12345, 'ports': [1, 2], 'ssh': ''}
+    for indent in (None, 2):
+        data = util.json_dumps(d, indent=indent)
+        assert isinstance(data, bytes)
+        assert util.json_loads(data) == d
+        assert util.json_loads(data.decode('utf8')) == d
+
+
+@mock.patch.object(util, 'orjson', None)
+def test_json_roundtrip_stdlib():
+    test_json_roundtrip()
+
+
+def test_json_load_file(tmpdir):
+    d = {'engines': {'0': 'abc'}, 'next_id': 1}
+    path = str(tmpdir.join('state.json'))
+    with open(path, 'wb') as f:
+        f.write(util.json_dumps(d))
+    assert util.json_load_file(path) == d
+    with mock.patch.object(util, 'orjson', None):
+        assert util.json_load_file(path) == d
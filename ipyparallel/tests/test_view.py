@@ -742,6 +742,28 @@ class TestView(ClusterTestCase):
         assert ar.wait_for_output(5)
         self.assertEqual(ar.data, [dict(i=4)] * len(ar))
 
+    def test_data_pub_flush_interval(self):
+        view = self.client[-1]
+        view.execute('get_ipython().data_pub.flush_interval = 60', block=True)
+        try:
+            ar = view.execute(
+                '\n'.join(
+                    [
+                        'from ipyparallel.datapub import publish_data',
+                        'for i in range(5):',
+                        '  publish_data(dict(i=i, j=-i))',
+                        'publish_data(dict(k=1))',
+                    ]
+                ),
+                block=False,
+            )
+            ar.get(5)
+            assert ar.wait_for_output(5)
+            # held-back data is sent when the request finishes
+            self.assertEqual(ar.data, dict(i=4, j=-4, k=1))
+        finally:
+            view.execute('get_ipython().data_pub.flush_interval = 0', block=True)
+
     def test_can_list_arg(self):
         """args in lists are canned"""
         view = self.client[-1]
@@ -857,6 +879,57 @@ class TestView(ClusterTestCase):
 
         assert view.apply_sync(find_ipython)
 
+    def test_apply_function_pickle_cache(self):
+        view = self.client[-1]
+
+        def f():
+            return 1
+
+        def g():
+            return 2
+
+        self.assertEqual(view.apply_sync(f), 1)
+        self.assertEqual(view.apply_sync(f), 1)
+        # the cached pickle isn't reused for changed code
+        f.__code__ = g.__code__
+        self.assertEqual(view.apply_sync(f), 2)
+
+        # closures are pickled with their current values
+        x = 1
+
+        def h():
+            return x
+
+        self.assertEqual(view.apply_sync(h), 1)
+        x = 3
+        self.assertEqual(view.apply_sync(h), 3)
+
+    def test_sync_imports_many(self):
+        view = self.client[-1]
+        with capture_output() as io:
+            with view.sync_imports():
+                import json
+                from os import path
+        self.assertIn("importing json", io.stdout)
+        self.assertIn("importing path from os", io.stdout)
+
+        @interactive
+        def find_imports():
+            return 'json' in globals() and 'path' in globals()
+
+        assert view.apply_sync(find_imports)
+
+    def test_broadcast_outstanding(self):
+        view = self.client.broadcast_view()
+        ar = view.apply_async(lambda x: x * 2, 3)
+        self.assertEqual(ar.get(timeout=10), [6] * len(self.client.ids))
+        ar.wait_for_send(10)
+        self.assertTrue(ar.sent)
+        # the original request gets no reply, so it mustn't be waited on
+        self.assertTrue(view.wait(timeout=10))
+        self.assertEqual(view.outstanding, set())
+        self.assertTrue(set(ar.msg_ids).isdisjoint(self.client.outstanding))
+
     @skip_without('cloudpickle')
     @pytest.mark.xfail(reason="cloudpickle doesn't seem to work right now")
     def test_use_cloudpickle(self):
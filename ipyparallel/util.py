@@ -14,7 +14,9 @@ except ImportError:
 
 
 from distutils.version import LooseVersion as V
+import json
 import logging
+import mmap
 import os
 import re
 import stat
@@ -54,6 +56,11 @@ else:
 
 from traitlets.log import get_logger
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 from jupyter_client.localinterfaces import localhost, is_public_ip, public_ips
 from ipython_genutils.py3compat import string_types, iteritems, itervalues
@@ -242,31 +249,40 @@ def disambiguate_ip_address(ip, location=None):
         If location is an IP of the current machine,
         localhost will be returned,
         otherwise location will be returned.
+
+    Results for wildcard IPs are cached,
+    as resolving location may require DNS lookups.
     """
-    if ip in {'0.0.0.0', '*'}:
-        if not location:
-            # unspecified location, localhost is the only choice
+    if ip not in {'0.0.0.0', '*'}:
+        return ip
+    return _disambiguate_wildcard(location)
+
+
+@lru_cache(maxsize=256)
+def _disambiguate_wildcard(location):
+    """The connectable address for a wildcard IP, for disambiguate_ip_address"""
+    if not location:
+        # unspecified location, localhost is the only choice
+        return localhost()
+    elif not is_ip(location):
+        if location == socket.gethostname():
+            # hostname matches, use localhost
             return localhost()
-        elif not is_ip(location):
-            if location == socket.gethostname():
-                # hostname matches, use localhost
-                return localhost()
-            else:
-                # hostname doesn't match, but the machine can have a few names.
-                location = ip_for_host(location)
-
-        if is_public_ip(location):
-            # location is a public IP on this machine, use localhost
-            ip = localhost()
-        elif not public_ips():
-            # this machine's public IPs cannot be determined,
-            # assume `location` is not this machine
-            warnings.warn("IPython could not determine public IPs", RuntimeWarning)
-            ip = location
         else:
-            # location is not this machine, do not use loopback
-            ip = location
-    return ip
+            # hostname doesn't match, but the machine can have a few names.
+            location = ip_for_host(location)
+
+    if is_public_ip(location):
+        # location is a public IP on this machine, use localhost
+        return localhost()
+    elif not public_ips():
+        # this machine's public IPs cannot be determined,
+        # assume `location` is not this machine
+        warnings.warn("IPython could not determine public IPs", RuntimeWarning)
+        return location
+    else:
+        # location is not this machine, do not use loopback
+        return location
 
 
 def disambiguate_url(url, location=None):
@@ -494,6 +510,45 @@ def int_keys(dikt):
     return dikt
 
 
+def json_dumps(obj, indent=None):
+    """Serialize obj to JSON bytes
+
+    Uses orjson if available, falling back on the stdlib json module.
+    orjson only supports indent=2, so any truthy indent uses that.
+    Without indent, the output is compact.
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, indent=indent).encode('utf8')
+    return json.dumps(obj, separators=(',', ':')).encode('utf8')
+
+
+def json_loads(data):
+    """Parse JSON from str or bytes
+
+    Uses orjson if available, falling back on the stdlib json module.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_load_file(path):
+    """Load JSON from the file at path
+
+    With orjson, the file is memory-mapped and parsed in place,
+    rather than first being read into a bytes object.
+    """
+    with open(path, 'rb') as f:
+        if orjson is None or os.fstat(f.fileno()).st_size == 0:
+            return json_loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as buf:
+                return orjson.loads(buf)
+
+
 def become_dask_worker(address, nanny=False, **kwargs):
     """Task function for becoming a dask.distributed Worker
 